@@ -1,6 +1,44 @@
 import os
 from PyQt4 import QtCore, QtGui
 
+NCHIPS = 32
+
+def parseChipList(text):
+    """
+    parses a chip list such as '0-3,8' into a sorted list of chip numbers.
+    returns None if the list is empty or names a chip that doesn't exist.
+    """
+    chips = set()
+    for item in text.replace(' ', '').split(','):
+        if not item:
+            continue
+        try:
+            if '-' in item:
+                first, last = [int(c) for c in item.split('-')]
+                chips.update(range(first, last+1))
+            else:
+                chips.add(int(item))
+        except ValueError:
+            return None
+    if not chips or min(chips) < 0 or max(chips) >= NCHIPS:
+        return None
+    return sorted(chips)
+
+def chipListText(chips):
+    """
+    formats a list of chip numbers as a chip list, collapsing runs to ranges
+    """
+    items = []
+    for chip in sorted(chips):
+        if items and chip == items[-1][1] + 1:
+            items[-1][1] = chip
+        else:
+            items.append([chip, chip])
+    return ','.join(str(a) if a == b else '%d-%d' % (a, b) for a, b in items)
+
+def chipListValidator(parent):
+    return QtGui.QRegExpValidator(QtCore.QRegExp(r'[0-9, \-]*'), parent)
+
 class PathButton(QtGui.QPushButton):
 
     def __init__(self, prompt, start_dir):
@@ -21,7 +59,10 @@ class PlaybackDialog(QtGui.QDialog):
         super(PlaybackDialog, self).__init__(parent)
 
         self.chipNumberLine = QtGui.QLineEdit('0')
-        self.chipNumberLine.setValidator(QtGui.QIntValidator(0,31,self))
+        self.chipNumberLine.setValidator(chipListValidator(self))
+
+        self.chipsPerRowLine = QtGui.QLineEdit('8')
+        self.chipsPerRowLine.setValidator(QtGui.QIntValidator(1,32,self))
 
         self.xrangeLine = QtGui.QLineEdit('1000')
         self.xrangeLine.setValidator(QtGui.QDoubleValidator(1,100000,1,self))
@@ -42,8 +83,10 @@ class PlaybackDialog(QtGui.QDialog):
         self.probeMapCheckbox.toggled.connect(lambda s: self.probeMapPath.setEnabled(s))
 
         layout = QtGui.QGridLayout()
-        layout.addWidget(QtGui.QLabel('Chip Number:'), 0,0, 1,1)
+        layout.addWidget(QtGui.QLabel('Chips (e.g. 0-31 or 0,4,8):'), 0,0, 1,1)
         layout.addWidget(self.chipNumberLine, 0,1, 1,2)
+        layout.addWidget(QtGui.QLabel('Chips per row:'), 1,0, 1,1)
+        layout.addWidget(self.chipsPerRowLine, 1,1, 1,2)
         layout.addWidget(QtGui.QLabel('Maximal displayed x-range (ms):'), 2,0, 1,1)
         layout.addWidget(self.xrangeLine, 2,1, 1,1)
         layout.addWidget(QtGui.QLabel('Refresh Rate (Hz):'), 3,0, 1,1)
@@ -60,7 +103,8 @@ class PlaybackDialog(QtGui.QDialog):
 
     def getParams(self):
         params = {}
-        params['chip'] = int(self.chipNumberLine.text())
+        params['chips'] = parseChipList(str(self.chipNumberLine.text())) or [0]
+        params['chipsPerRow'] = int(self.chipsPerRowLine.text())
         params['xrange'] = int(self.xrangeLine.text())
         params['refreshRate'] = int(self.refreshRateLine.text())
         if self.probeMapCheckbox.checkState():
@@ -0,0 +1,192 @@
+#!/usr/bin/env python2
+""" Headless performance measurements for the Playback window. """
+
+import sys, time, itertools
+
+import numpy as np
+import h5py
+
+from ringbuffer import RingBuffer
+from vertices import DisplayLOD
+from streamfilter import StreamFilter
+from reference import ReferenceStage
+from datapath import processFrame
+
+sys.path.append('../lib/py')
+from SnapshotReader import SnapshotReader, NCHANNELS
+
+nrows = 8
+ncols = 4
+nchans = nrows*ncols
+
+XRANGES_MS = [1000, 2000, 5000, 10000, 20000, 50000, 100000]
+CANVAS_WIDTH_PX = 1920
+
+# configurations timed by measureThroughput
+THROUGHPUT_XRANGES_MS = [1000, 10000, 100000]
+THROUGHPUT_REFRESH_RATES = [20, 60]
+THROUGHPUT_NFRAMES = 200
+
+def makeSnapshot(filename, seconds=10., nactive=NCHANNELS, seed=0):
+    """
+    writes a synthetic snapshot in Willow's format: offset-binary uint16
+    channel_data stored flat, one 1024-channel sample after the other, and a
+    sample_index. the first nactive channels carry noise with a common
+    component and occasional spikes; the others are flat.
+    """
+    nsamples = int(seconds*30000)
+    rng = np.random.RandomState(seed)
+    f = h5py.File(filename, 'w')
+    dset = f.create_dataset('channel_data', (nsamples*NCHANNELS,), dtype='uint16')
+    f.create_dataset('sample_index', data=np.arange(nsamples, dtype='uint32'))
+    block = 30000
+    for start in range(0, nsamples, block):
+        n = min(block, nsamples - start)
+        uv = np.zeros((n, NCHANNELS))
+        uv[:,:nactive] = 20*rng.randn(n, nactive) + 50*rng.randn(n, 1)
+        spikes = rng.randint(0, n*nactive, n*nactive//3000)
+        uv[:,:nactive].flat[spikes] -= 300
+        counts = np.clip(uv/0.195 + 2**15, 0, 2**16-1).astype('uint16')
+        dset[start*NCHANNELS:(start+n)*NCHANNELS] = counts.ravel()
+    f.close()
+
+def measureStartup(xranges=XRANGES_MS, width_px=CANVAS_WIDTH_PX):
+    """
+    times the host-side construction of a PlaybackWindow's display buffer
+    and ChipCanvas vertex data (everything done before handing buffers to
+    the GPU, including the first full upload), for each x-range. returns a
+    list of (xrange_ms, nvertices, seconds)
+    """
+    results = []
+    for xrange_ms in xranges:
+        nsamps = 30*xrange_ms - 1   # as in PlaybackWindow
+        t0 = time.time()
+        displayBuff = RingBuffer(nchans, nsamps, dtype=np.float32)
+        lod = DisplayLOD(nchans, nsamps)
+        lod.update(1., width_px * 0.95 / ncols)
+        a_index = lod.vertexIndices()
+        order = lod.drawOrder()
+        positions = lod.pack(displayBuff.data, 0, lod.nslots)
+        results.append((xrange_ms, a_index.shape[0]*nchans, time.time() - t0))
+        del displayBuff, a_index, order, positions
+    return results
+
+class Uploader(object):
+    """
+    stands in for ChipCanvas: draw_new_data() repacks vertex data as the
+    canvas does. with gl=True, data really is uploaded to a vertex buffer of
+    a hidden vispy canvas (and waited for); otherwise only the host-side
+    repacking is timed.
+    """
+
+    def __init__(self, gl=False):
+        self.gl = gl
+        self.lod = None
+        if gl:
+            from vispy import app, gloo
+            self.canvas = app.Canvas(show=False)
+            self.canvas.context.set_current()
+            self.gloo = gloo
+            self.buffer = gloo.VertexBuffer(np.zeros(1, dtype=np.float32))
+
+    def setData(self, data):
+        if self.gl:
+            self.buffer.set_data(data)
+
+    def setSubdata(self, data, offset):
+        if self.gl:
+            self.buffer.set_subdata(data, offset=offset)
+
+    def draw_new_data(self, new_yvals, latest_point, ranges):
+        for offset, data in self.lod.packRanges(new_yvals, ranges):
+            self.setSubdata(data, offset)
+
+    def finish(self):
+        if self.gl:
+            self.canvas.context.finish()
+
+def measureThroughput(filename, chips=[0], filtering=False, ref=False,
+                      xrange_ms=1000, refreshRate=20, nframes=THROUGHPUT_NFRAMES,
+                      width_px=CANVAS_WIDTH_PX, uploader=None):
+    """
+    times nframes frames of PlaybackWindow's data path (datapath.processFrame:
+    read, reference, filter, display buffer write and vertex repacking), as
+    fast as possible. returns an array of per-frame latencies, in seconds.
+    """
+    if uploader is None:
+        uploader = Uploader()
+    chans = np.concatenate([np.arange(chip*nchans, (chip+1)*nchans)
+                            for chip in chips])
+    nsamps = 30*xrange_ms - 1   # as in PlaybackWindow
+    nrefresh = 30000//refreshRate
+    reader = SnapshotReader(filename, chunkSize=4*nrefresh)
+    refStage = ReferenceStage(chans, chans)
+    reader.setChannels(refStage.readChans if ref else chans)
+    streamFilter = StreamFilter(len(chans), 300., 9500.)
+    displayBuff = RingBuffer(len(chans), nsamps, dtype=np.float32)
+    lod = DisplayLOD(len(chans), nsamps)
+    lod.update(1., width_px * 0.95 / (ncols*min(len(chips), 8)))
+    uploader.lod = lod
+    uploader.setData(lod.pack(displayBuff.data, 0, lod.nslots))
+
+    latencies = np.zeros(nframes)
+    for i in range(nframes):
+        if reader.cursor + nrefresh > reader.nsamples:
+            reader.seek(0)
+            streamFilter.reset()
+        t0 = time.time()
+        processFrame(reader, nrefresh, refStage if ref else None,
+                     streamFilter if filtering else None, displayBuff,
+                     uploader.draw_new_data)
+        uploader.finish()
+        latencies[i] = time.time() - t0
+    reader.close()
+    return latencies
+
+def printThroughput(filename, chips=[0], gl=False):
+    """
+    runs measureThroughput over all combinations of x-range, refresh rate,
+    filtering and software reference, and prints latency percentiles and
+    the sustained sample rate of each
+    """
+    uploader = Uploader(gl)
+    print '%10s %8s %6s %4s %9s %9s %9s %12s %8s' % ('xrange_ms', 'refresh',
+        'filter', 'ref', 'p50_ms', 'p95_ms', 'p99_ms', 'samples/s', 'realtime')
+    for xrange_ms, refreshRate, filtering, ref in itertools.product(
+            THROUGHPUT_XRANGES_MS, THROUGHPUT_REFRESH_RATES, (False, True), (False, True)):
+        latencies = measureThroughput(filename, chips, filtering, ref,
+                                      xrange_ms, refreshRate, uploader=uploader)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])*1000
+        rate = (30000//refreshRate) * len(latencies) / latencies.sum()
+        print '%10d %8d %6s %4s %9.2f %9.2f %9.2f %12d %7.1fx' % (xrange_ms,
+            refreshRate, filtering, ref, p50, p95, p99, rate, rate/30000.)
+
+USAGE = """Usage: ./benchmark.py startup
+       ./benchmark.py synth <snapshot.h5> [seconds] [active channels]
+       ./benchmark.py throughput <snapshot.h5> [chips, e.g. 0-3] [gl]"""
+
+if __name__=='__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('startup', 'synth', 'throughput'):
+        print USAGE
+        sys.exit(1)
+
+    if sys.argv[1] == 'startup':
+        print '%10s %12s %10s' % ('xrange_ms', 'vertices', 'seconds')
+        for xrange_ms, nvertices, seconds in measureStartup():
+            print '%10d %12d %10.3f' % (xrange_ms, nvertices, seconds)
+    elif sys.argv[1] == 'synth':
+        if len(sys.argv) < 3:
+            print USAGE
+            sys.exit(1)
+        seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10.
+        nactive = int(sys.argv[4]) if len(sys.argv) > 4 else NCHANNELS
+        makeSnapshot(sys.argv[2], seconds, nactive)
+    else:
+        if len(sys.argv) < 3:
+            print USAGE
+            sys.exit(1)
+        chips = [0]
+        if len(sys.argv) > 3:
+            from PlaybackDialog import parseChipList
+            chips = parseChipList(sys.argv[3])
+        printThroughput(sys.argv[2], chips, gl=(sys.argv[-1] == 'gl'))
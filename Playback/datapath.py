@@ -0,0 +1,33 @@
+#!/usr/bin/env python2
+
+def processFrame(reader, n, refStage, streamFilter, displayBuff, upload,
+                 stageTimer=None):
+    """
+    PlaybackWindow's per-frame data path: reads the next n samples, subtracts
+    the software reference (unless refStage is None), filters them (unless
+    streamFilter is None), writes them to the display buffer, and hands the
+    buffer to upload(yvals, last_point, ranges), which takes what
+    ChipCanvas.draw_new_data() takes. returns the processed samples.
+
+    benchmark.py times this very function, so all per-frame work belongs
+    here rather than in PlaybackWindow.updatePlot.
+    """
+    mark = stageTimer.mark if stageTimer is not None else lambda stage: None
+    block = reader.read(n)
+    mark('read')
+
+    # only the newly arrived samples are processed
+    if refStage is not None:
+        # subtract the reference from good channels (leave bad channels);
+        # if all reference channels are bad, data is left as is
+        block = refStage.process(block)
+    mark('reference')
+
+    if streamFilter is not None:
+        block = streamFilter.process(block)
+    mark('filter')
+
+    last_point = displayBuff.write(block)
+    upload(displayBuff.data, last_point, displayBuff.last_ranges)
+    mark('upload')
+    return block
@@ -6,14 +6,21 @@ from matplotlib.figure import Figure
 import numpy as np
 import scipy.signal as signal
 
+from streamfilter import SAMPLE_RATE
+
 class FilterPlotWindow(QtGui.QWidget):
-    def __init__(self, filt, cutoffs):
+    def __init__(self, streamFilter):
         super(FilterPlotWindow, self).__init__(None)
 
-        freqs = (np.pi / 1.5e4) * np.logspace(np.log10(cutoffs[0])-0.5, np.log10(1.5e4))
-        freqs, h = signal.freqz(*filt, worN=freqs)
+        nyq = SAMPLE_RATE / 2
+        cutoffs = [streamFilter.lowcut, streamFilter.highcut]
+        freqs = (np.pi / nyq) * np.logspace(np.log10(cutoffs[0])-0.5, np.log10(nyq))
+        freqs, h = signal.sosfreqz(streamFilter.sos, worN=freqs)
+        if streamFilter.zerophase:
+            # filtered forwards and backwards: squared gain, no phase shift
+            h = abs(h)**2
         # convert frequencies from rad/s to Hz
-        freqs = (1.5e4 / np.pi) * freqs
+        freqs = (nyq / np.pi) * freqs
         # get magnitude in dB and phase in degrees
         mag = 20 * np.log10(abs(h))
         phase = np.rad2deg(np.angle(h))
@@ -0,0 +1,58 @@
+import numpy as np
+
+class ReferenceStage(object):
+    """
+    Common-average (or common-median) software reference for streaming data.
+
+    The reference is computed over refChans, which need not be among the
+    displayed channels chans: data is read for the union of both sets
+    (readChans), and process() maps a block of read channels to a block of
+    displayed channels. The reference is subtracted from the displayed
+    channels selected by applyMask; the others are passed through as is.
+
+    All channel index arrays are computed once, here, so each frame only
+    costs one reduction over the newly arrived samples and one subtraction.
+    """
+
+    def __init__(self, chans, refChans, applyMask=None, method='mean'):
+        self.chans = np.asarray(chans)
+        self.refChans = np.asarray(refChans, dtype=int)
+        if applyMask is None:
+            applyMask = np.ones(len(self.chans), dtype=bool)
+        self.method = method
+        self.readChans = np.union1d(self.chans, self.refChans)
+        self.dispIdx = np.searchsorted(self.readChans, self.chans)
+        self.refIdx = np.searchsorted(self.readChans, self.refChans)
+        self.applyIdx = np.flatnonzero(applyMask)
+        self.out = None
+
+    def setMethod(self, method):
+        if method not in ('mean', 'median'):
+            raise Exception('Unknown reference method {}.'.format(method))
+        self.method = method
+
+    def reference(self, block):
+        """
+        returns the reference signal of block, with shape (len(readChans), n),
+        or None if there are no reference channels
+        """
+        if len(self.refIdx) == 0:
+            return None
+        if self.method == 'median':
+            return np.median(block[self.refIdx,:], axis=0)
+        return block[self.refIdx,:].mean(axis=0)
+
+    def process(self, block):
+        """
+        re-reference block, with shape (len(readChans), n), and return the
+        displayed channels, with shape (len(chans), n). the returned array is
+        reused by the next call.
+        """
+        n = block.shape[1]
+        if self.out is None or self.out.shape[1] != n:
+            self.out = np.empty((len(self.chans), n))
+        np.take(block, self.dispIdx, axis=0, out=self.out)
+        ref = self.reference(block)
+        if ref is not None:
+            self.out[self.applyIdx,:] -= ref
+        return self.out
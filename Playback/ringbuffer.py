@@ -0,0 +1,53 @@
+import numpy as np
+
+class RingBuffer(object):
+    """
+    Fixed-size circular display buffer of shape (nchans, nsamps).
+
+    New blocks of samples are written in place at the current write point,
+    wrapping around to the beginning of the buffer as necessary, so the cost
+    of a write scales with the size of the block rather than the buffer.
+    """
+
+    def __init__(self, nchans, nsamps, dtype='float'):
+        self.nchans = nchans
+        self.nsamps = nsamps
+        self.data = np.zeros((nchans, nsamps), dtype=dtype)
+        self.rewind()
+
+    def rewind(self):
+        """
+        move the write point back to the start of the buffer (data is kept)
+        """
+        self.write_point = 0
+        self.latest_point = self.nsamps - 1
+        self.last_ranges = []
+
+    def clear(self):
+        self.data.fill(0)
+        self.rewind()
+
+    def write(self, block):
+        """
+        write block, with shape (nchans, n), at the write point and return the
+        index of the most recently written sample (the "latest point").
+        the column ranges touched by this write are kept in self.last_ranges
+        as a list of (start, stop) tuples.
+        """
+        n = block.shape[1]
+        if n > self.nsamps:
+            # only the most recent nsamps samples can ever be displayed
+            self.write_point = (self.write_point + n - self.nsamps) % self.nsamps
+            block = block[:,-self.nsamps:]
+            n = self.nsamps
+        start = self.write_point
+        first = min(n, self.nsamps - start)
+        self.data[:,start:start+first] = block[:,:first]
+        self.last_ranges = [(start, start+first)]
+        if first < n:
+            # overflow of new data back to beginning of buffer
+            self.data[:,:n-first] = block[:,first:]
+            self.last_ranges.append((0, n-first))
+        self.write_point = (start + n) % self.nsamps
+        self.latest_point = (self.write_point - 1) % self.nsamps
+        return self.latest_point
@@ -0,0 +1,106 @@
+import time
+
+class FrameScheduler(object):
+    """
+    Paces playback against a monotonic clock.
+
+    At each frame, nextFrame() works out how many samples of the recording
+    are due (elapsed time x sample rate x speed) and have not been played
+    yet. Up to maxLagFrames frames' worth of them are played at once; any
+    older samples are skipped, so playback never falls further behind real
+    time than that.
+
+    A frame is counted as dropped whenever the clock has advanced past the
+    end of the frame period it was expected in, without a frame being
+    played.
+    """
+
+    def __init__(self, frameRate, sampleRate=30000, speed=1., maxLagFrames=3,
+                 clock=time.time):
+        self.frameRate = frameRate
+        self.sampleRate = sampleRate
+        self.speed = speed
+        self.maxLagFrames = maxLagFrames
+        self.clock = clock
+        self.running = False
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.nframes = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def start(self):
+        self.t0 = self.clock()
+        self.played = 0       # samples played since t0
+        self.expected = 0     # frames expected since t0
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def setSpeed(self, speed):
+        self.speed = speed
+        if self.running:
+            self.start()    # re-anchor, so the cursor doesn't jump
+
+    def samplesPerFrame(self):
+        return int(round(self.sampleRate * self.speed / self.frameRate))
+
+    def nextFrame(self):
+        """
+        returns (skip, n): the number of samples to skip, then the number of
+        samples to play in this frame
+        """
+        elapsed = self.clock() - self.t0
+        due = int(elapsed * self.sampleRate * self.speed) - self.played
+        expected = int(elapsed * self.frameRate)
+        self.dropped += max(0, expected - self.expected - 1)
+        self.expected = max(expected, self.expected)
+        if due <= 0:
+            return 0, 0
+        maxBatch = self.maxLagFrames * self.samplesPerFrame()
+        skip = max(0, due - maxBatch)
+        n = due - skip
+        self.played += due
+        self.skipped += skip
+        self.nframes += 1
+        return skip, n
+
+class StageTimer(object):
+    """
+    Keeps running averages of the time spent in each stage of a frame, and
+    of the achieved frame rate.
+
+    Call begin() at the start of a frame, mark(stage) at the end of each
+    stage, and end() at the end of the frame.
+    """
+
+    def __init__(self, stages, clock=time.time, smoothing=0.1):
+        self.stages = stages
+        self.clock = clock
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.times = dict((stage, 0.) for stage in self.stages)
+        self.fps = 0.
+        self.t_frame = None
+
+    def begin(self):
+        self.t_mark = self.clock()
+
+    def mark(self, stage):
+        t = self.clock()
+        self.times[stage] += self.smoothing * ((t - self.t_mark) - self.times[stage])
+        self.t_mark = t
+
+    def end(self):
+        t = self.clock()
+        if self.t_frame is not None and t > self.t_frame:
+            self.fps += self.smoothing * (1./(t - self.t_frame) - self.fps)
+        self.t_frame = t
+
+    def summary(self):
+        return ', '.join('%s %.1f ms' % (stage, 1000*self.times[stage])
+                         for stage in self.stages)
@@ -0,0 +1,77 @@
+import numpy as np
+import scipy.signal as signal
+
+SAMPLE_RATE = 30000.    # Hz
+
+class StreamFilter(object):
+    """
+    Band-pass Butterworth filter for streaming data, implemented as cascaded
+    second-order sections.
+
+    Filter state is kept per channel across calls to process(), so each frame
+    only needs to filter its newly arrived samples. The design is cached and
+    only recomputed when the cutoffs change.
+
+    In zero-phase mode, the causally filtered stream is additionally filtered
+    backwards over a window extending `lookahead` samples past the output
+    block. The output is then delayed by `lookahead` samples.
+    """
+
+    def __init__(self, nchans, lowcut, highcut, order=5, zerophase=False,
+                 lookahead=300):
+        self.nchans = nchans
+        self.order = order
+        self.zerophase = zerophase
+        self.lookahead = lookahead
+        self.setCutoffs(lowcut, highcut)
+
+    def setCutoffs(self, lowcut, highcut):
+        nyq = SAMPLE_RATE / 2
+        try:
+            if not (0 < lowcut < highcut < nyq):
+                raise ValueError
+            sos = signal.butter(self.order, [lowcut/nyq, highcut/nyq],
+                                btype='bandpass', output='sos')
+        except ValueError:
+            raise Exception('Illegal filtering cutoffs (low={}, high={}).'.format(
+                   lowcut, highcut))
+        self.lowcut = lowcut
+        self.highcut = highcut
+        self.sos = sos
+        self.sos_zi = signal.sosfilt_zi(self.sos) # (nsections, 2)
+        self.reset()
+
+    def setZeroPhase(self, zerophase):
+        self.zerophase = zerophase
+        self.reset()
+
+    def setChannelCount(self, nchans):
+        self.nchans = nchans
+        self.reset()
+
+    def reset(self):
+        """
+        forget all filter state; the next block starts a new stream
+        """
+        self.zi = None
+        self.history = np.zeros((self.nchans, self.lookahead))
+
+    def process(self, block):
+        """
+        filter block, with shape (nchans, n), continuing from the state left
+        by the previous call. returns an array of the same shape.
+        """
+        if self.zi is None:
+            # start in steady state w.r.t. the first sample, to avoid a
+            # transient from each channel's DC offset
+            self.zi = self.sos_zi[:,np.newaxis,:] * block[np.newaxis,:,:1]
+        filtered, self.zi = signal.sosfilt(self.sos, block, axis=1, zi=self.zi)
+        if not self.zerophase:
+            return filtered
+        n = block.shape[1]
+        segment = np.concatenate((self.history, filtered), axis=1)
+        zi_back = self.sos_zi[:,np.newaxis,:] * segment[np.newaxis,:,-1:]
+        backward, _ = signal.sosfilt(self.sos, segment[:,::-1], axis=1,
+                                     zi=zi_back)
+        self.history = segment[:,n:]
+        return backward[:,::-1][:,:n]
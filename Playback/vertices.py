@@ -0,0 +1,147 @@
+import numpy as np
+
+# subplot grid of a single chip's channels
+CHIP_NROWS = 8
+CHIP_NCOLS = 4
+CHIP_NCHANS = CHIP_NROWS*CHIP_NCOLS
+
+# above this many samples per pixel column, min/max envelopes are drawn
+ENVELOPE_THRESHOLD = 2
+
+def chipGrid(nchips, chipsPerRow):
+    """
+    lays out the channels of nchips chips as a grid of subplots, with each
+    chip's channels in an 8 row x 4 column block and chipsPerRow blocks per
+    row of chips. returns (chan_cols, chan_rows, ncols, nrows): the subplot
+    column and row of every displayed channel, and the size of the grid.
+    """
+    chipsPerRow = max(1, min(chipsPerRow, nchips))
+    idx = np.arange(nchips*CHIP_NCHANS)
+    chip, chan = idx // CHIP_NCHANS, idx % CHIP_NCHANS
+    chan_cols = (chip % chipsPerRow)*CHIP_NCOLS + chan % CHIP_NCOLS
+    chan_rows = (chip // chipsPerRow)*CHIP_NROWS + chan // CHIP_NCOLS
+    ncols = chipsPerRow*CHIP_NCOLS
+    nrows = -(-nchips // chipsPerRow)*CHIP_NROWS
+    return chan_cols, chan_rows, ncols, nrows
+
+def vertexIndices(nchans, times):
+    """
+    returns the a_index vertex attribute of a ChipCanvas, as an array of shape
+    (len(times), nchans, 2) holding the (channel, sample) of every vertex.
+    vertices are time-major: vertex i*nchans + chan is the i'th vertex of
+    channel chan, drawn at sample position times[i].
+    """
+    a_index = np.empty((len(times), nchans, 2), dtype=np.float32)
+    a_index[:,:,0] = np.arange(nchans)
+    a_index[:,:,1] = np.asarray(times)[:,np.newaxis]
+    return a_index
+
+def drawOrder(nchans, nverts):
+    """
+    returns the index buffer contents that draw time-major vertices channel
+    by channel, as one line strip
+    """
+    return (np.arange(nverts, dtype=np.uint32)[np.newaxis,:]*nchans +
+            np.arange(nchans, dtype=np.uint32)[:,np.newaxis]).ravel()
+
+class DisplayLOD(object):
+    """
+    Level-of-detail bookkeeping for a ChipCanvas.
+
+    Only the window of samples visible at the current horizontal zoom is
+    drawn. When that window holds many more samples than the subplot is wide
+    in pixels, it is split into bins of binsize samples and each bin is drawn
+    as a (min, max) pair of vertices, so spikes remain visible. Otherwise
+    every sample gets its own vertex. Either way, the number of vertices per
+    channel is bounded by a small multiple of the subplot's pixel width.
+
+    The visible window is divided into nslots slots (samples or bins) of
+    vps vertices each.
+    """
+
+    def __init__(self, nchans, nsamps):
+        self.nchans = nchans
+        self.nsamps = nsamps
+        self.window = None
+
+    def update(self, scale_x, width_px):
+        """
+        recompute the visible window for a horizontal zoom factor and subplot
+        width; returns True if the vertex layout has changed
+        """
+        nvisible = self.nsamps / float(scale_x)
+        center = (self.nsamps - 1) / 2.
+        # one sample of margin on either side, so lines reach the plot edges
+        v0 = max(0, int(np.floor(center - nvisible/2.)) - 1)
+        v1 = min(self.nsamps, int(np.ceil(center + nvisible/2.)) + 2)
+        width_px = max(1, int(width_px))
+        if (v1 - v0) > ENVELOPE_THRESHOLD*width_px:
+            binsize = (v1 - v0) // width_px
+        else:
+            binsize = 1
+        window = (v0, v1, binsize)
+        if window == self.window:
+            return False
+        self.window = window
+        self.v0, self.v1, self.binsize = window
+        self.vps = 1 if self.binsize == 1 else 2
+        self.nslots = -(-(self.v1 - self.v0) // self.binsize)
+        return True
+
+    def vertexIndices(self):
+        starts = self.v0 + np.arange(self.nslots)*self.binsize
+        times = np.minimum(starts + (self.binsize - 1) / 2., self.v1 - 1)
+        return vertexIndices(self.nchans, np.repeat(times, self.vps))
+
+    def drawOrder(self):
+        return drawOrder(self.nchans, self.nslots*self.vps)
+
+    def slotRange(self, start, stop):
+        """
+        returns the slots [j0, j1) covering samples [start, stop), or None if
+        none of those samples are visible
+        """
+        start = max(start, self.v0)
+        stop = min(stop, self.v1)
+        if start >= stop:
+            return None
+        j0 = (start - self.v0) // self.binsize
+        j1 = -(-(stop - self.v0) // self.binsize)
+        return j0, j1
+
+    def packRanges(self, yvals, ranges):
+        """
+        returns (offset, data) pairs of the a_position data to upload after
+        samples in ranges [(start, stop), ...] of yvals changed, with offsets
+        as the position buffer's set_subdata() takes them
+        """
+        packed = []
+        for (start, stop) in ranges:
+            slots = self.slotRange(start, stop)
+            if slots is not None:
+                j0, j1 = slots
+                packed.append((j0*self.vps*self.nchans, self.pack(yvals, j0, j1)))
+        return packed
+
+    def pack(self, yvals, j0, j1):
+        """
+        returns the float32 a_position data of slots [j0, j1), for display
+        data yvals with shape (nchans, nsamps), laid out time-major
+        """
+        start = self.v0 + j0*self.binsize
+        stop = min(self.v0 + j1*self.binsize, self.v1)
+        segment = yvals[:,start:stop]
+        if self.binsize == 1:
+            return np.ascontiguousarray(segment.T, dtype=np.float32).ravel()
+        packed = np.empty((j1-j0, 2, self.nchans), dtype=np.float32)
+        nfull = (stop - start) // self.binsize
+        if nfull > 0:
+            bins = segment[:,:nfull*self.binsize].reshape(
+                (self.nchans, nfull, self.binsize))
+            packed[:nfull,0,:] = bins.min(axis=2).T
+            packed[:nfull,1,:] = bins.max(axis=2).T
+        if nfull < (j1 - j0):
+            # the last bin of the window may be partial
+            packed[nfull,0,:] = segment[:,nfull*self.binsize:].min(axis=1)
+            packed[nfull,1,:] = segment[:,nfull*self.binsize:].max(axis=1)
+        return packed.ravel()
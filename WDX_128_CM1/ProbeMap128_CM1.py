@@ -6,8 +6,7 @@ from PyQt4.QtCore import Qt
 import numpy as np
 
 from CursorRect import CursorRect
-
-from viridis import viridis as cmap
+from PadLayer import PadLayer
 
 
 class ProbeMap128_CM1(QtGui.QLabel):
@@ -79,8 +78,12 @@ class ProbeMap128_CM1(QtGui.QLabel):
                         self.dy,                                                # height
                         1))                                                     # corner rounding
 
+        # background and pads, colored on setActivity() and drawn in one go
+        self.padLayer = PadLayer(self.size(), self.scaled_pixmap, self.pads)
+
     def setActivity(self, activity):
         self.activity = activity
+        self.padLayer.setActivity(activity)
         self.repaint()
 
     def increment(self):
@@ -153,17 +156,7 @@ class ProbeMap128_CM1(QtGui.QLabel):
         pen.setStyle(Qt.NoPen)
         painter.setPen(pen)
 
-        # draw image centrally in the widget
-        point = QtCore.QPoint(0,0)
-        point.setX((self.size().width() - self.scaled_pixmap.width())/2)
-        point.setY((self.size().height() - self.scaled_pixmap.height())/2)
-        painter.drawPixmap(point, self.scaled_pixmap)
-
-        for row in range(self.rows):
-            for col in range(self.cols):
-                brush = QtGui.QBrush(QtGui.QColor(*tuple(cmap(self.activity[row, col]))))
-                painter.setBrush(brush)
-                painter.drawRoundedRect(*self.pads[self.cols * row + col].params(), mode=Qt.RelativeSize)
+        self.padLayer.draw(painter)
 
         brush = QtGui.QBrush(QtGui.QColor(255, 255, 255, 64))
         painter.setBrush(brush)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python2
+
+import threading
+
+import numpy as np
+import scipy.signal as signal
+
+from SnapshotReader import SnapshotReader, NCHANNELS
+from SliceCache import SliceCache
+from ShankData import SAMPLE_RATE, LOWCUT, HIGHCUT, ORDER
+
+OVERVIEW_BIN = 3000         # samples per bin at the finest level (100 ms)
+OVERVIEW_FACTOR = 4         # bins per bin of the next level
+# bins are visited every 64th first, then every 16th, ..., so a rough
+#   overview of the whole snapshot is there early on
+OVERVIEW_STRIDES = [64, 16, 4, 1]
+# windows are shown with at most this many bins
+MAX_WINDOW_BINS = 2000
+# activity of a window is summed over at least this many bins (when the
+#   window is that long), so partly covered bins at its edges matter little
+MIN_ACTIVITY_BINS = 64
+
+class ActivityOverview(object):
+    """
+    A multi-resolution summary of a snapshot's channels, built in a single
+    streaming pass over the file (on a background thread, see start()).
+
+    For every bin of OVERVIEW_BIN samples and every channel, it holds the
+    sum of squares of the band-passed signal (giving the RMS activity) and
+    the min and max of the raw and band-passed signal (giving decimated
+    traces of windows of any length). Coarser levels, each OVERVIEW_FACTOR
+    times coarser than the one below, are added when the pass is done. The
+    result is kept in the snapshot's SliceCache, so it is only ever built
+    once.
+
+    While the pass runs, bins that haven't been visited yet take the values
+    of the nearest visited bin to their left.
+    """
+
+    def __init__(self, filename, chans, binSize=OVERVIEW_BIN):
+        self.filename = filename
+        self.chans = sorted(chans)
+        self.chan2row = dict((chan, i) for i, chan in enumerate(self.chans))
+        self.binSize = binSize
+        self.reader = SnapshotReader(filename)
+        self.nsamples = self.reader.nsamples
+        self.nbins = -(-self.nsamples // binSize)
+        shape = (len(self.chans), self.nbins)
+        self.stats = {}
+        for name in ['ss', 'min', 'max', 'fmin', 'fmax']:
+            self.stats[name] = np.zeros(shape, dtype=np.float32)
+        self.done = np.zeros(self.nbins, dtype=bool)
+        self.ndone = 0
+        self.complete = False
+        self.levels = [self.stats]
+        self.scaleKey = self.scaleValue = None
+        nyq = SAMPLE_RATE / 2
+        self.sos = signal.butter(ORDER, [LOWCUT/nyq, HIGHCUT/nyq], btype='bandpass',
+                                 output='sos')
+        self.thread = None
+
+    def cacheKey(self, cache):
+        return cache.key('ActivityOverview', self.chans, 0, self.nsamples,
+                         {'binSize': self.binSize, 'lowcut': LOWCUT,
+                          'highcut': HIGHCUT, 'order': ORDER})
+
+    def start(self):
+        """
+        loads the overview from the slice cache, or starts building it
+        """
+        cache = SliceCache(self.filename)
+        try:
+            attrs = cache.load(self.cacheKey(cache))
+        except (IOError, OSError):
+            attrs = None
+        if attrs is not None:
+            self.stats = dict((name, attrs[name]) for name in self.stats)
+            self.done[:] = True
+            self.ndone = self.nbins
+            self.finish()
+            return
+        self.thread = threading.Thread(target=self.build, args=(cache,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def build(self, cache=None):
+        for stride in OVERVIEW_STRIDES:
+            for b in range(0, self.nbins, stride):
+                if not self.done[b]:
+                    self.visit(b)
+        self.finish()
+        if cache is not None:
+            try:
+                cache.store(self.cacheKey(cache), self.stats)
+            except Exception as e:
+                print 'Could not cache activity overview: %s' % e
+
+    def visit(self, b):
+        start = b * self.binSize
+        stop = min(start + self.binSize, self.nsamples)
+        data = self.reader.readRange(start, stop, self.chans)
+        filtered = signal.sosfiltfilt(self.sos, data, axis=1)
+        self.stats['ss'][:,b] = np.einsum('ij,ij->i', filtered, filtered)
+        self.stats['min'][:,b] = data.min(axis=1)
+        self.stats['max'][:,b] = data.max(axis=1)
+        self.stats['fmin'][:,b] = filtered.min(axis=1)
+        self.stats['fmax'][:,b] = filtered.max(axis=1)
+        self.done[b] = True
+        self.ndone += 1
+
+    def finish(self):
+        levels = [self.stats]
+        while levels[-1]['ss'].shape[1] > 1:
+            below = levels[-1]
+            levels.append({'ss': self.reduce(below['ss'], np.add),
+                           'min': self.reduce(below['min'], np.minimum),
+                           'max': self.reduce(below['max'], np.maximum),
+                           'fmin': self.reduce(below['fmin'], np.minimum),
+                           'fmax': self.reduce(below['fmax'], np.maximum)})
+        self.levels = levels
+        self.complete = True
+
+    def reduce(self, a, ufunc):
+        n = a.shape[1]
+        return ufunc.reduceat(a, np.arange(0, n, OVERVIEW_FACTOR), axis=1)
+
+    def level(self, nbins):
+        """
+        returns (stats, binSize) of the coarsest level with at least nbins
+        bins over the whole snapshot
+        """
+        if not self.complete:
+            # fill in bins not visited yet
+            idx = np.where(self.done, np.arange(self.nbins), 0)
+            idx = np.maximum.accumulate(idx)
+            if self.ndone:
+                idx[:np.argmax(self.done)] = np.argmax(self.done)
+            return dict((name, a[:,idx]) for name, a in self.stats.items()), self.binSize
+        i = 0
+        while (i+1 < len(self.levels) and
+                self.levels[i+1]['ss'].shape[1] >= nbins):
+            i += 1
+        return self.levels[i], self.binSize * OVERVIEW_FACTOR**i
+
+    def image(self, npix):
+        """
+        returns the RMS activity of each channel over the whole snapshot at
+        npix columns, scaled to [0, 1] by its 99th percentile
+        """
+        stats, binSize = self.level(npix)
+        nbins = stats['ss'].shape[1]
+        edges = np.linspace(0, nbins, npix+1).astype(int)
+        edges = np.minimum(edges[:-1], nbins-1)
+        counts = np.diff(np.append(edges, nbins)).clip(1)
+        ss = np.add.reduceat(stats['ss'], edges, axis=1)
+        rms = np.sqrt(ss / (counts * binSize))
+        top = np.percentile(rms, 99) if rms.size else 0.
+        return np.clip(rms / max(top, 1e-12), 0, 1)
+
+    def window(self, start, stop, traceChans, maxBins=MAX_WINDOW_BINS):
+        """
+        returns the attributes of a window of samples [start, stop) as
+        SlidingSliceLoader sets them, but with min/max envelopes of the
+        traces instead of the traces themselves (slice_x gives the time of
+        each value, in ms from start)
+        """
+        stats, binSize = self.level(-(-self.nsamples // (stop - start)) * maxBins)
+        b0, b1 = start // binSize, -(-stop // binSize)
+        rows = [self.chan2row[chan] for chan in traceChans]
+        def envelope(lo, hi):
+            values = np.empty((len(rows), 2*(b1-b0)))
+            values[:,0::2] = stats[lo][rows,b0:b1]
+            values[:,1::2] = stats[hi][rows,b0:b1]
+            return values
+        x = np.repeat(np.arange(b0, b1) * binSize, 2)
+        x[:2] = start
+        attrs = {'slice_decimated': True}
+        attrs['slice_uv'] = envelope('min', 'max')
+        attrs['slice_filtered'] = envelope('fmin', 'fmax')
+        attrs['slice_x'] = (x - start) * 1000. / SAMPLE_RATE
+        attrs['slice_nsamples'] = stop - start
+        attrs['chan2slice_idx'] = dict((chan, i) for i, chan in enumerate(traceChans))
+        attrs['slice_min'] = stats['min'][:,b0:b1].min()
+        attrs['slice_max'] = stats['max'][:,b0:b1].max()
+        attrs['slice_filtered_min'] = stats['fmin'][:,b0:b1].min()
+        attrs['slice_filtered_max'] = stats['fmax'][:,b0:b1].max()
+        attrs['slice_reference'] = attrs['slice_reference_filtered'] = None
+        attrs['slice_activity'] = self.activity(start, stop)
+        return attrs
+
+    def activity(self, start, stop, scale=None):
+        """
+        returns the RMS activity of each channel over samples [start, stop),
+        indexed by channel (as slice_activity), divided by scale, or by that
+        of the most active channel if scale is None
+
+        Unlike level(), this doesn't copy the overview while it is being
+        built; bins not visited yet are left out, or if there are none in
+        the window, the nearest visited bin to its left is used.
+        """
+        i = 0
+        while (self.complete and i+1 < len(self.levels) and
+                (stop - start) >= MIN_ACTIVITY_BINS * self.binSize * OVERVIEW_FACTOR**(i+1)):
+            i += 1
+        ss, binSize = self.levels[i]['ss'], self.binSize * OVERVIEW_FACTOR**i
+        b0 = min(start // binSize, ss.shape[1] - 1)
+        b1 = min(max(-(-stop // binSize), b0 + 1), ss.shape[1])
+        if self.complete:
+            nsamples = min(b1 * binSize, self.nsamples) - b0 * binSize
+            rms = np.sqrt(ss[:,b0:b1].sum(axis=1) / nsamples)
+        else:
+            done = np.flatnonzero(self.done[b0:b1]) + b0
+            if not len(done):
+                done = np.flatnonzero(self.done[:b0])[-1:]
+            if len(done):
+                rms = np.sqrt(ss[:,done].sum(axis=1) / (len(done) * binSize))
+            else:
+                rms = np.zeros(len(self.chans))
+        if scale is None:
+            scale = np.max(rms) if len(rms) else 0.
+        activity = np.zeros(NCHANNELS)
+        activity[self.chans] = rms / max(scale, 1e-12)
+        return activity
+
+    def scale(self):
+        """
+        returns the 99th percentile of the RMS activity of all channels' bins,
+        for showing the activity of different windows on the same scale
+        """
+        # while the overview is built, recomputed every 16th of the way
+        key = (self.complete, self.ndone * 16 // max(self.nbins, 1))
+        if key != self.scaleKey:
+            ss = self.stats['ss'] if self.complete else self.stats['ss'][:,self.done]
+            rms = np.sqrt(ss / self.binSize)
+            self.scaleValue = np.percentile(rms, 99) if rms.size else 0.
+            self.scaleKey = key
+        return self.scaleValue
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+
+from PyQt4 import QtCore
+
+from ShankData import SAMPLE_RATE
+
+PLAYER_FPS = 20
+
+class ActivityPlayer(QtCore.QObject):
+    """
+    Moves a window over a snapshot's activity, as recorded by an
+    ActivityOverview, for showing on a ProbeMap without reading or filtering
+    any samples.
+
+    follow() shows the activity of a window as soon as it is moved (e.g.
+    while a TimeScrubber selection is being dragged, before its samples are
+    loaded). play() animates the window through the snapshot at speed times
+    real time, until stop() or the end of the snapshot. While playing, all
+    frames are shown on the same scale (ActivityOverview.scale()), so quiet
+    stretches look quiet; otherwise, as with slice_activity, the most active
+    channel of the window is the top of the scale.
+    """
+
+    activityChanged = QtCore.pyqtSignal(object)    # activity, indexed by channel
+    positionChanged = QtCore.pyqtSignal(int, int)  # start, stop of the frame
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, overview, fps=PLAYER_FPS, speed=1.):
+        QtCore.QObject.__init__(self)
+        self.overview = overview
+        self.speed = speed
+        self.window = None
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(1000 // fps)
+        self.timer.timeout.connect(self.advance)
+
+    def isPlaying(self):
+        return self.timer.isActive()
+
+    def follow(self, start, stop):
+        self.window = (start, stop)
+        self.show()
+
+    def play(self, start, stop):
+        self.window = (start, stop)
+        self.timer.start()
+        self.show()
+
+    def stop(self):
+        if self.timer.isActive():
+            self.timer.stop()
+            self.finished.emit()
+
+    def setSpeed(self, speed):
+        self.speed = speed
+
+    def advance(self):
+        start, stop = self.window
+        step = int(self.speed * SAMPLE_RATE * self.timer.interval() / 1000.)
+        step = min(step, self.overview.nsamples - stop)
+        self.window = (start + step, stop + step)
+        self.positionChanged.emit(*self.window)
+        self.show()
+        if step <= 0 or self.window[1] >= self.overview.nsamples:
+            self.stop()
+
+    def show(self):
+        scale = self.overview.scale() if self.isPlaying() else None
+        self.activityChanged.emit(self.overview.activity(*self.window, scale=scale))
@@ -0,0 +1,28 @@
+#!/usr/bin/env python2
+
+from willowephys import WillowDataset
+
+# filename: [dataset, reference count]
+_datasets = {}
+
+def acquireDataset(filename):
+    """
+    returns this process's shared WillowDataset for filename, creating it
+    on first use. every call must be matched by a releaseDataset(filename).
+    """
+    if filename not in _datasets:
+        _datasets[filename] = [WillowDataset(filename), 0]
+    _datasets[filename][1] += 1
+    return _datasets[filename][0]
+
+def releaseDataset(filename):
+    """
+    drops a reference to the shared dataset for filename; the dataset is
+    forgotten once nobody holds it
+    """
+    entry = _datasets.get(filename)
+    if entry is None:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        del _datasets[filename]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+
+import os, re, glob, time
+
+import numpy as np
+import h5py
+
+# impedances in this range (in ohms) are considered good
+ZRANGE_LOWER_LIMIT = 1e5
+ZRANGE_UPPER_LIMIT = 1e6
+
+# e.g. impedance_20150917-153205.h5, snapshot_20150917-160012.h5
+TIMESTAMP_PATTERN = re.compile(r'(\d{8}-\d{6})')
+
+def fileTimestamp(filename):
+    """
+    returns the time (in seconds since the epoch) in a willow file name,
+    falling back to the file's modification time
+    """
+    match = TIMESTAMP_PATTERN.search(os.path.basename(filename))
+    if match:
+        try:
+            return time.mktime(time.strptime(match.group(1), '%Y%m%d-%H%M%S'))
+        except ValueError:
+            pass
+    return os.path.getmtime(filename)
+
+class Impedance(object):
+    """
+    One impedance measurement, read in a single pass, with everything the
+    tools derive from it precomputed per channel:
+
+        ohms, kohms     impedances
+        good            within [ZRANGE_LOWER_LIMIT, ZRANGE_UPPER_LIMIT]
+        bad             not good
+        open            above ZRANGE_UPPER_LIMIT (open-circuit channels)
+        goodChannels    the channel numbers where good is True
+        labels          e.g. '312 k', for plot titles
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        f = h5py.File(filename, 'r')
+        try:
+            self.ohms = np.asarray(f['impedanceMeasurements'][:], dtype=float)
+        finally:
+            f.close()
+        self.kohms = self.ohms / 1000.
+        self.good = (self.ohms >= ZRANGE_LOWER_LIMIT) & (self.ohms <= ZRANGE_UPPER_LIMIT)
+        self.bad = ~self.good
+        self.open = self.ohms > ZRANGE_UPPER_LIMIT
+        self.goodChannels = np.flatnonzero(self.good)
+        self.labels = ['%.0f k' % z for z in self.kohms]
+
+    def __len__(self):
+        return len(self.ohms)
+
+class ImpedanceIndex(object):
+    """
+    The impedance_*.h5 files of a directory, sorted by the time they were
+    measured. Measurements are loaded on first use and kept.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        filenames = glob.glob(os.path.join(directory, 'impedance*.h5'))
+        self.files = sorted((fileTimestamp(filename), filename)
+                            for filename in filenames)
+        self.measurements = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def latest(self):
+        return self.files[-1][1] if self.files else None
+
+    def nearest(self, snapshotFilename):
+        """
+        returns the name of the impedance file measured closest in time to a
+        snapshot, or None if there is none
+        """
+        if not self.files:
+            return None
+        t = fileTimestamp(snapshotFilename)
+        return min(self.files, key=lambda (tz, filename): abs(tz - t))[1]
+
+    def load(self, filename):
+        filename = os.path.abspath(filename)
+        if filename not in self.measurements:
+            self.measurements[filename] = Impedance(filename)
+        return self.measurements[filename]
+
+# directory: ImpedanceIndex
+_indexes = {}
+
+def impedanceIndex(directory):
+    """
+    returns this process's (shared) index of the impedance files in directory
+    """
+    directory = os.path.abspath(directory)
+    if directory not in _indexes:
+        _indexes[directory] = ImpedanceIndex(directory)
+    return _indexes[directory]
+
+def loadImpedance(filename):
+    """
+    returns the (shared) Impedance of an impedance file
+    """
+    return impedanceIndex(os.path.dirname(os.path.abspath(filename))).load(filename)
+
+def snapshotImpedance(snapshotFilename):
+    """
+    returns the Impedance measured closest in time to a snapshot, from the
+    snapshot's directory, or None if there is none
+    """
+    index = impedanceIndex(os.path.dirname(os.path.abspath(snapshotFilename)))
+    filename = index.nearest(snapshotFilename)
+    if filename is None:
+        return None
+    return index.load(filename)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python2
+
+import numpy as np
+
+from SliceCache import sliceCache
+
+class MinMaxPyramid(object):
+    """
+    Multi-resolution min/max envelopes of per-channel traces.
+
+    Level 0 is the data itself, with shape (nchans, nsamples). Each level
+    above holds the minima and maxima of blocks of factor**level samples.
+    With that, a decimated envelope of any sample range at a given number of
+    pixels costs time proportional to the number of pixels, and the extrema
+    of any sample range cost time proportional to log(nsamples).
+    """
+
+    def __init__(self, data, factor=4, levels=None):
+        self.data = data
+        self.factor = factor
+        self.nchans, self.nsamples = data.shape
+        if levels is None:
+            levels = self.build()
+        self.mins = [data] + [mins for mins, maxs in levels]
+        self.maxs = [data] + [maxs for mins, maxs in levels]
+
+    def build(self):
+        levels = []
+        mins = maxs = self.data
+        while mins.shape[1] > 1:
+            mins = self.reduce(mins, np.minimum)
+            maxs = self.reduce(maxs, np.maximum)
+            levels.append((mins, maxs))
+        return levels
+
+    def reduce(self, a, ufunc):
+        # combine blocks of factor columns, the last block may be partial
+        n = a.shape[1]
+        nfull = n // self.factor
+        out = np.empty((a.shape[0], -(-n // self.factor)), dtype=a.dtype)
+        out[:,:nfull] = ufunc.reduce(
+            a[:,:nfull*self.factor].reshape((a.shape[0], nfull, self.factor)), axis=2)
+        if nfull < out.shape[1]:
+            out[:,nfull] = ufunc.reduce(a[:,nfull*self.factor:], axis=1)
+        return out
+
+    def envelope(self, chan, start, stop, npix):
+        """
+        returns (indices, values) approximating samples [start, stop) of a
+        channel at npix pixels. when there are more than 2 samples per pixel,
+        each pixel gets a (min, max) pair of values at the same index.
+        """
+        start = max(0, start)
+        stop = min(self.nsamples, stop)
+        npix = max(1, int(npix))
+        if stop - start <= 2*npix:
+            return np.arange(start, stop), self.data[chan,start:stop]
+        # coarsest level with at least one block per pixel
+        level = 0
+        while self.factor**(level+1) <= (stop - start) // npix:
+            level += 1
+        blocksize = self.factor**level
+        j0, j1 = start // blocksize, -(-stop // blocksize)
+        group = -(-(j1 - j0) // npix)
+        nbins = -(-(j1 - j0) // group)
+        mins = np.empty(nbins*group, dtype=self.data.dtype)
+        maxs = np.empty(nbins*group, dtype=self.data.dtype)
+        mins[:j1-j0] = self.mins[level][chan,j0:j1]
+        maxs[:j1-j0] = self.maxs[level][chan,j0:j1]
+        mins[j1-j0:] = mins[j1-j0-1]
+        maxs[j1-j0:] = maxs[j1-j0-1]
+        indices = np.repeat((j0 + np.arange(nbins)*group) * blocksize, 2)
+        indices[:2] = start
+        values = np.empty(2*nbins, dtype=self.data.dtype)
+        values[0::2] = mins.reshape((nbins, group)).min(axis=1)
+        values[1::2] = maxs.reshape((nbins, group)).max(axis=1)
+        # the first and last bins may only partly overlap [start, stop)
+        values[0:2] = self.rangeMinMax(start, min(stop, (j0 + group)*blocksize),
+                                       [chan])
+        values[-2:] = self.rangeMinMax(max(start, (j0 + (nbins-1)*group)*blocksize),
+                                       stop, [chan])
+        return indices, values
+
+    def rangeMinMax(self, start, stop, chans=None):
+        """
+        returns the (min, max) of samples [start, stop) over chans (defaults
+        to all channels)
+        """
+        if chans is None:
+            chans = slice(None)
+        start = max(0, start)
+        stop = min(self.nsamples, stop)
+        lo, hi = np.inf, -np.inf
+        level = 0
+        while start < stop:
+            # take partial blocks at the edges from this level, then go up
+            a = min(stop, -(-start // self.factor) * self.factor)
+            b = max(a, (stop // self.factor) * self.factor)
+            for j0, j1 in ((start, a), (b, stop)):
+                if j1 > j0:
+                    lo = min(lo, np.min(self.mins[level][chans,j0:j1]))
+                    hi = max(hi, np.max(self.maxs[level][chans,j0:j1]))
+            start, stop = a // self.factor, b // self.factor
+            level += 1
+        return lo, hi
+
+def slicePyramid(dataset, name='slice_filtered', factor=4):
+    """
+    returns a MinMaxPyramid of a slice attribute of a dataset (slice_uv or
+    slice_filtered), loading it from the snapshot's SliceCache when it has
+    been built before
+
+    the cache entry is keyed on the parameters of whatever produced the
+    slice, which the dataset gives as sliceParams (see ShankView); without
+    them, the pyramid is only built in memory
+    """
+    data = getattr(dataset, name)
+    params = getattr(dataset, 'sliceParams', None)
+    if params is None:
+        return MinMaxPyramid(data, factor)
+    chans = sorted(dataset.chan2slice_idx, key=dataset.chan2slice_idx.get)
+    cache = sliceCache(dataset.filename)
+    try:
+        key = cache.key('MinMaxPyramid:' + name, chans,
+            float(dataset.time_ms[0]), float(dataset.time_ms[-1]),
+            dict(params, factor=factor))
+        attrs = cache.load(key)
+    except (IOError, OSError):
+        key, attrs = None, None
+    if attrs is not None:
+        nlevels = len(attrs) // 2
+        levels = [(attrs['min%d' % i], attrs['max%d' % i]) for i in range(nlevels)]
+        return MinMaxPyramid(data, factor, levels)
+    pyramid = MinMaxPyramid(data, factor)
+    if key is not None:
+        attrs = {}
+        for i in range(1, len(pyramid.mins)):
+            attrs['min%d' % (i-1)] = pyramid.mins[i]
+            attrs['max%d' % (i-1)] = pyramid.maxs[i]
+        try:
+            cache.store(key, attrs)
+        except Exception as e:
+            print 'Could not cache pyramid of %s: %s' % (name, e)
+    return pyramid
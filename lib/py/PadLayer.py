@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+
+from PyQt4 import QtGui, QtCore
+
+import numpy as np
+
+from viridis import viridisBGRA
+
+class PadLayer(object):
+    """
+    The background image and activity-colored pads of a ProbeMap widget,
+    pre-rendered into one pixmap.
+
+    The pads are rasterized once, into an image of the widget's size that
+    holds the index of the pad at each pixel. setActivity() then colors all
+    pads at once, with a single colormap lookup and a single indexed
+    assignment, and recomposites the pixmap; draw() is one blit, however
+    many pads there are. Pads are drawn as plain rectangles (the widgets'
+    rounding of 1% doesn't show at their size).
+    """
+
+    def __init__(self, size, background, pads):
+        # size: of the widget; background: pixmap drawn centered in it;
+        #   pads: CursorRects, in the order activity values are given in
+        self.size = size
+        self.background = background
+        self.origin = QtCore.QPoint((size.width() - background.width()) / 2,
+                                    (size.height() - background.height()) / 2)
+        w, h = size.width(), size.height()
+        labels = -np.ones((h, w), dtype=np.int32)
+        for i, pad in enumerate(pads):
+            x, y, pw, ph = [int(round(v)) for v in pad.params()[:4]]
+            labels[max(y, 0):max(y + ph, 0), max(x, 0):max(x + pw, 0)] = i
+        self.mask = labels >= 0
+        self.labels = labels[self.mask]
+        self.npads = len(pads)
+        self.bgra = np.zeros((h, w, 4), dtype=np.uint8)
+        self.setActivity(np.zeros(self.npads))
+
+    def setActivity(self, activity):
+        """
+        colors the pads by activity (values between 0 and 1, one per pad)
+        """
+        colors = viridisBGRA(np.ravel(activity)[:self.npads])
+        self.bgra[self.mask] = colors[self.labels]
+        image = QtGui.QImage(self.bgra.data, self.size.width(), self.size.height(),
+                             QtGui.QImage.Format_ARGB32)
+        self.pixmap = QtGui.QPixmap(self.size)
+        self.pixmap.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(self.pixmap)
+        painter.drawPixmap(self.origin, self.background)
+        painter.drawImage(0, 0, image)
+        painter.end()
+
+    def draw(self, painter):
+        painter.drawPixmap(0, 0, self.pixmap)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+
+import os, sys, pickle, tempfile
+
+import numpy as np
+
+from SnapshotReader import NCHANNELS
+
+# columns of ProbeGeometry.reverse
+SHANK, ROW, COL, X, Y = range(5)
+
+def sidecarFilename(filename):
+    """
+    returns the name of the binary sidecar of a probe map, e.g.
+    probeMap_64_level2_canonical.npz for probeMap_64_level2_canonical.p
+    """
+    return os.path.splitext(filename)[0] + '.npz'
+
+def compileProbeMap(filename):
+    """
+    reads a pickled probe map ({(shank, row, col): chan, 'nrows': ..., ...})
+    and returns its sites as a dense (nshanks, nrows, ncols) array of
+    channels, -1 where there is no site, along with chip2conn (as an
+    (nchips, 2) array; empty if the map has none)
+    """
+    probeMap = pickle.load(open(filename, 'rb'))
+    keys = [key for key in probeMap if isinstance(key, tuple)]
+    shape = tuple(probeMap.get(name, max(key[i] for key in keys) + 1)
+                  for i, name in enumerate(['nshanks', 'nrows', 'ncols']))
+    forward = -np.ones(shape, dtype=np.int32)
+    for key in keys:
+        if not isinstance(probeMap[key], (int, long)):
+            raise ValueError('%s maps %s to %r, not to a channel'
+                             % (filename, key, probeMap[key]))
+        forward[key] = probeMap[key]
+    chip2conn = np.array(sorted(probeMap.get('chip2conn', {}).items()),
+                         dtype=np.int32).reshape(-1, 2)
+    return forward, chip2conn
+
+def writeSidecar(filename):
+    """
+    compiles a probe map into its sidecar, and returns the sidecar's name
+    """
+    forward, chip2conn = compileProbeMap(filename)
+    sidecar = sidecarFilename(filename)
+    # written under a temporary name first, so readers never see half a file
+    fd, tmp = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(sidecar)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, forward=forward, chip2conn=chip2conn)
+        os.rename(tmp, sidecar)
+    except:
+        os.remove(tmp)
+        raise
+    return sidecar
+
+class ProbeGeometry(object):
+    """
+    A probe map as dense arrays, for lookups by indexing instead of by
+    scanning the map's keys:
+
+        forward         (nshanks, nrows, ncols): channel of each site, or -1
+        reverse         (NCHANNELS, 5): shank, row, col, x, y of each channel
+                        (columns SHANK, ROW, COL, X, Y), or -1's if it has
+                        no site; x and y are in site pitches over the whole
+                        probe, with the shanks side by side one column apart
+        shankChans      [shank]: channels of the shank, in row-major order
+        channels        all mapped channels, sorted
+        chip2conn       {chip: connector}, if the map has it
+
+    It is loaded from the map's .npz sidecar, which is (re)compiled from the
+    pickle when it is missing or older than the pickle.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        sidecar = sidecarFilename(filename)
+        if (not os.path.exists(sidecar) or
+                os.path.getmtime(sidecar) < os.path.getmtime(filename)):
+            try:
+                writeSidecar(filename)
+            except (IOError, OSError) as e:
+                # e.g. a read-only checkout; compile in memory every time
+                print 'Could not write %s: %s' % (sidecar, e)
+                sidecar = None
+        if sidecar is not None:
+            arrays = np.load(sidecar)
+            forward, chip2conn = arrays['forward'], arrays['chip2conn']
+        else:
+            forward, chip2conn = compileProbeMap(filename)
+
+        self.forward = forward
+        self.nshanks, self.nrows, self.ncols = forward.shape
+        self.chip2conn = dict(chip2conn.tolist())
+
+        shanks, rows, cols = np.nonzero(forward >= 0)
+        chans = forward[shanks, rows, cols]
+        self.reverse = -np.ones((max(NCHANNELS, chans.max() + 1), 5), dtype=np.int32)
+        self.reverse[chans] = np.column_stack(
+            [shanks, rows, cols, shanks * (self.ncols + 1) + cols, rows])
+        self.channels = np.sort(chans)
+        self.shankChans = [forward[shank][forward[shank] >= 0]
+                           for shank in range(self.nshanks)]
+        self.shanks = [shank for shank in range(self.nshanks)
+                       if len(self.shankChans[shank])]
+
+    def channel(self, shank, row, col):
+        return int(self.forward[shank, row, col])
+
+    def site(self, chan):
+        """
+        returns the (shank, row, col) of a channel, or None if it is not
+        on the probe
+        """
+        if not 0 <= chan < len(self.reverse) or self.reverse[chan, SHANK] < 0:
+            return None
+        return tuple(self.reverse[chan, :X].tolist())
+
+# filename: ProbeGeometry
+_geometries = {}
+
+def probeGeometry(filename):
+    """
+    returns this process's (shared) ProbeGeometry of a probe map file
+    """
+    filename = os.path.abspath(filename)
+    if filename not in _geometries:
+        _geometries[filename] = ProbeGeometry(filename)
+    return _geometries[filename]
+
+if __name__=='__main__':
+    if len(sys.argv) < 2:
+        print 'Usage: ./ProbeGeometry.py <probeMap.p> [<probeMap.p> ...]'
+        sys.exit(1)
+    for filename in sys.argv[1:]:
+        try:
+            print '%s -> %s' % (filename, writeSidecar(filename))
+        except ValueError as e:
+            print 'Skipped %s' % e
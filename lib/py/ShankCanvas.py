@@ -0,0 +1,324 @@
+#!/usr/bin/env python2
+
+from PyQt4 import QtCore, QtGui
+
+import numpy as np
+
+from vispy import gloo, app, visuals
+from vispy.visuals import transforms
+
+from SpikeScopeWindow import SpikeScopeWindow
+from MinMaxPyramid import slicePyramid
+from ImpedanceIndex import loadImpedance
+
+VERT_SHADER = """
+#version 120
+
+// Channel (subplot index) and time since the start of the slice, in ms.
+attribute vec2 a_index;
+varying vec2 v_index;
+
+// y coordinate of the position, in uV.
+attribute float a_position;
+
+// Displayed time and voltage ranges, shared by all subplots.
+uniform vec2 u_xrange;
+uniform vec2 u_yrange;
+
+// Number of subplot columns and of visible rows, and the first visible row.
+uniform vec2 u_grid;
+uniform float u_row0;
+
+// Per-channel color, one texel for each of the u_nchans channels.
+uniform sampler2D u_colors;
+uniform float u_nchans;
+varying vec4 v_color;
+
+// Varying variables used for clipping in the fragment shader.
+varying vec2 v_position;
+varying vec4 v_ab;
+
+void main() {
+    float row = floor((a_index.x + 0.5) / u_grid.x);
+    float col = a_index.x - row*u_grid.x;
+    row -= u_row0;
+    // Normalize data to fit within a subplot, in range (-1,1).
+    float x = -1 + 2*(a_index.y - u_xrange.x) / (u_xrange.y - u_xrange.x);
+    float y = -1 + 2*(a_position - u_yrange.x) / (u_yrange.y - u_yrange.x);
+    // Affine transformation for the subplot.
+    vec2 a = vec2(1./u_grid.x, 1./u_grid.y)*vec2(0.95, 0.85);
+    vec2 b = vec2(-1 + 2*(col + 0.5) / u_grid.x,
+                   1 - 2*(row + 0.5) / u_grid.y);
+    gl_Position = vec4(a*vec2(x, y)+b, 0.0, 1.0);
+
+    v_color = texture2D(u_colors, vec2((a_index.x + 0.5) / u_nchans, 0.5));
+    v_index = a_index;
+    // For clipping test in the fragment shader.
+    v_position = gl_Position.xy;
+    v_ab = vec4(a, b);
+}
+"""
+
+FRAG_SHADER = """
+#version 120
+
+varying vec4 v_color;
+varying vec2 v_index;
+
+varying vec2 v_position;
+varying vec4 v_ab;
+
+void main() {
+    gl_FragColor = v_color;
+    // Discard the fragments between the signals (emulate glMultiDrawArrays).
+    if (fract(v_index.x) > 0.)
+        discard;
+    // Clipping test.
+    vec2 test = abs((v_position.xy-v_ab.zw)/v_ab.xy);
+    if ((test.x > 1) || (test.y > 1))
+        discard;
+}
+"""
+
+DEFAULT_VISIBLE_ROWS = 16
+
+class ShankCanvas(app.Canvas):
+    """
+    Draws all channels of a shank in one GL program, as an alternative to
+    MultiPlotWidget's grid of pyqtgraph plots.
+
+    All subplots share one x/y range, set by uniforms, so zooming and
+    panning only redraw. Shortly after the view settles, the traces are
+    re-uploaded as min/max envelopes of the visible time range, at the
+    subplots' pixel width. Only the visible rows are uploaded (and drawn),
+    so scrolling through rows uploads the rows scrolled to.
+
+    Mousewheel scrolls through rows, Ctrl-Mousewheel zooms horizontally,
+    Ctrl-Shift-Mousewheel zooms vertically, dragging pans horizontally, and
+    double-clicking a subplot opens a SpikeScope for its channel.
+    """
+
+    def __init__(self, dataset, geometry, shank, impedanceFile):
+        self.dataset = dataset
+        self.geometry = geometry
+        self.shank = shank
+
+        self.ncols = self.geometry.ncols
+        self.nrows = self.geometry.nrows
+        self.nchannels = self.ncols * self.nrows
+        self.visibleRows = min(DEFAULT_VISIBLE_ROWS, self.nrows)
+        self.row0 = 0
+        self.uploadedRows = None    # (row0, visibleRows) of the buffers
+
+        # subplots are in row-major order, as in MultiPlotWidget
+        self.rows, self.cols, self.chans = [], [], []
+        for i in range(self.nchannels):
+            row, col = i // self.ncols, i % self.ncols
+            self.rows.append(row)
+            self.cols.append(col)
+            self.chans.append(self.geometry.channel(self.shank, row, col))
+        self.slice_idx = np.array([self.dataset.chan2slice_idx[chan]
+                                   for chan in self.chans])
+
+        self.pyramids = {}
+        self.filtered = True
+        self.showLabels = True
+        self.titles = ['Row %d, Col %d, Chan %d' % (row, col, chan) for
+                       row, col, chan in zip(self.rows, self.cols, self.chans)]
+        self.default_rgb = np.array((0.559, 0.855, 0.563))
+        self.bad_impedance_rgb = np.array((0.5, 0.5, 0.5))
+        self.colors = np.ones((1, self.nchannels, 4), dtype=np.float32)
+        self.colors[0,:,:3] = self.default_rgb
+
+        self._program = gloo.Program(VERT_SHADER, FRAG_SHADER)
+        self.index_buffer = gloo.VertexBuffer(np.zeros((1, 2), dtype=np.float32))
+        self.position_buffer = gloo.VertexBuffer(np.zeros(1, dtype=np.float32))
+        self._program['a_index'] = self.index_buffer
+        self._program['a_position'] = self.position_buffer
+        self.color_texture = gloo.Texture2D(self.colors, interpolation='nearest',
+                                            internalformat='rgba32f')
+        self._program['u_colors'] = self.color_texture
+        self._program['u_nchans'] = self.nchannels
+        self._program['u_grid'] = (self.ncols, self.visibleRows)
+        self._program['u_row0'] = self.row0
+
+        self.label_visual = None
+
+        super(ShankCanvas, self).__init__(app='pyqt4', keys='interactive')
+
+        gloo.set_viewport(0, 0, *self.physical_size)
+        gloo.set_state(clear_color=(0.10, 0.10, 0.10, 1.0), blend=True,
+                       blend_func=('src_alpha', 'one_minus_src_alpha'))
+
+        # traces are re-uploaded once the view has settled
+        self.uploadTimer = QtCore.QTimer()
+        self.uploadTimer.setSingleShot(True)
+        self.uploadTimer.timeout.connect(self.uploadTraces)
+
+        self.setDefaultRange(self.filtered)
+        self.applyImpedanceFile(impedanceFile)
+
+    def getPyramid(self, name):
+        if name not in self.pyramids:
+            self.pyramids[name] = slicePyramid(self.dataset, name)
+        return self.pyramids[name]
+
+    def uploadTraces(self):
+        """
+        uploads the envelopes of the visible rows' traces; the buffers hold
+        nothing else, so drawing them draws only the visible subplots
+        """
+        pyramid = self.getPyramid('slice_filtered' if self.filtered else 'slice_uv')
+        t0, t1 = self.xrange
+        time_ms = self.dataset.time_ms
+        start = max(0, np.searchsorted(time_ms, t0) - 1)
+        stop = np.searchsorted(time_ms, t1) + 1
+        npix = max(100, int(self.physical_size[0] / self.ncols))
+        i0 = self.row0*self.ncols
+        i1 = min(self.row0 + self.visibleRows, self.nrows)*self.ncols
+        traces = [pyramid.envelope(idx, start, stop, npix) for idx in self.slice_idx[i0:i1]]
+        indices = traces[0][0]
+        a_index = np.empty((i1 - i0, len(indices), 2), dtype=np.float32)
+        # subplot indices stay global; the shader offsets them by u_row0
+        a_index[:,:,0] = np.arange(i0, i1)[:,np.newaxis]
+        # times are relative to the start of the slice, for float32 precision
+        a_index[:,:,1] = time_ms[indices] - self.dataset.timeMin
+        self.index_buffer.set_data(a_index.reshape((-1, 2)))
+        self.position_buffer.set_data(
+            np.array([values for _, values in traces], dtype=np.float32).ravel())
+        self.uploadedRows = (self.row0, self.visibleRows)
+        self.update()
+
+    def setRange(self, xrange=None, yrange=None, upload=True):
+        if xrange is not None:
+            t0, t1 = xrange
+            span = min(t1 - t0, self.dataset.timeMax - self.dataset.timeMin)
+            span = max(span, 1.)
+            t0 = min(max(t0, self.dataset.timeMin), self.dataset.timeMax - span)
+            self.xrange = (t0, t0 + span)
+            self._program['u_xrange'] = (t0 - self.dataset.timeMin,
+                                         t0 + span - self.dataset.timeMin)
+            if upload:
+                self.uploadTimer.start(150)
+        if yrange is not None:
+            self.yrange = yrange
+            self._program['u_yrange'] = self.yrange
+        self.update()
+
+    def setDefaultRange(self, filtered=True):
+        dataMin = self.dataset.slice_filtered_min if filtered else self.dataset.slice_min
+        dataMax = self.dataset.slice_filtered_max if filtered else self.dataset.slice_max
+        # same padding as pyqtgraph's setYRange(..., padding=0.9)
+        pad = 0.9*(dataMax - dataMin)
+        self.setRange((self.dataset.timeMin, self.dataset.timeMax),
+                      (dataMin - pad, dataMax + pad), upload=False)
+        self.uploadTraces()
+
+    def toggleFiltered(self, filtered):
+        self.filtered = filtered
+        self.uploadTraces()
+
+    def toggleAxes(self, axes):
+        self.showLabels = axes
+        self.update()
+
+    def applyImpedanceFile(self, impedanceFile):
+        self.impedanceFile = str(impedanceFile) if impedanceFile else False
+        if self.impedanceFile:
+            impedance = loadImpedance(self.impedanceFile)
+            self.colors[0,:,:3] = self.default_rgb
+            self.colors[0,impedance.bad[self.chans],:3] = self.bad_impedance_rgb
+            self.color_texture.set_data(self.colors)
+            self.titles = ['Row %d, Col %d, Chan %d, Z = %s' %
+                           (row, col, chan, impedance.labels[chan]) for row, col, chan in
+                           zip(self.rows, self.cols, self.chans)]
+        self.updateLabels()
+
+    def scrollRows(self, delta):
+        row0 = min(max(0, self.row0 + delta), self.nrows - self.visibleRows)
+        if row0 != self.row0:
+            self.row0 = row0
+            self._program['u_row0'] = self.row0
+            self.updateLabels()
+            self.uploadTraces()
+
+    def verticalZoom(self, delta):
+        """
+        shows fewer (delta > 0) or more (delta < 0) rows at once
+        """
+        if delta > 0:
+            visibleRows = max(1, int(self.visibleRows / 1.5))
+        else:
+            visibleRows = min(self.nrows, int(np.ceil(self.visibleRows * 1.5)))
+        self.visibleRows = visibleRows
+        self._program['u_grid'] = (self.ncols, self.visibleRows)
+        self.row0 = min(self.row0, self.nrows - self.visibleRows)
+        self._program['u_row0'] = self.row0
+        self.updateLabels()
+        if self.uploadedRows != (self.row0, self.visibleRows):
+            self.uploadTraces()
+
+    def subplotAt(self, pos):
+        col = int(self.ncols * pos[0] / self.size[0])
+        row = int(self.visibleRows * pos[1] / self.size[1]) + self.row0
+        if 0 <= col < self.ncols and 0 <= row < self.nrows:
+            return row*self.ncols + col
+        return None
+
+    def updateLabels(self):
+        if self.label_visual is None:
+            self.label_visual = visuals.TextVisual(text='',
+                color=(0.5,0.5,0.5,1.0), font_size=8, pos=(0,0), anchor_x='left')
+            self.label_visual.transform = transforms.NullTransform()
+        a = (self.physical_size[0]/float(self.ncols),
+             self.physical_size[1]/float(self.visibleRows))
+        texts, poses = [], []
+        for i in range(self.row0*self.ncols,
+                       (self.row0 + self.visibleRows)*self.ncols):
+            texts.append(' ' + self.titles[i])
+            poses.append((a[0]*(i % self.ncols), a[1]*(i//self.ncols - self.row0 + 0.04)))
+        self.label_visual.text = texts
+        self.label_visual.pos = poses
+
+    def on_resize(self, event):
+        vp = 0, 0, self.physical_size[0], self.physical_size[1]
+        self.context.set_viewport(*vp)
+        self.updateLabels()
+        self.label_visual.transforms.configure(canvas=self, viewport=vp)
+        self.uploadTimer.start(150)
+
+    def on_draw(self, event):
+        gloo.clear()
+        self._program.draw('line_strip')
+        if self.showLabels:
+            self.label_visual.draw()
+
+    def on_mouse_wheel(self, event):
+        d = np.sign(event.delta[1])
+        if 'Control' in event.modifiers and 'Shift' in event.modifiers:
+            y0, y1 = self.yrange
+            c, h = (y0 + y1)/2., (y1 - y0)/2. * np.exp(-0.125*d)
+            self.setRange(yrange=(c - h, c + h))
+        elif 'Control' in event.modifiers:
+            # zoom around the time under the mouse
+            t0, t1 = self.xrange
+            frac = (event.pos[0] * self.ncols / float(self.size[0])) % 1.
+            t = t0 + frac*(t1 - t0)
+            s = np.exp(-0.125*d)
+            self.setRange(xrange=(t - frac*(t1 - t0)*s, t + (1 - frac)*(t1 - t0)*s))
+        else:
+            self.scrollRows(-int(d))
+
+    def on_mouse_move(self, event):
+        if event.is_dragging and event.button == 1:
+            dx = event.pos[0] - event.last_event.pos[0]
+            t0, t1 = self.xrange
+            dt = -dx * (t1 - t0) * self.ncols / float(self.size[0])
+            self.setRange(xrange=(t0 + dt, t1 + dt))
+
+    def on_mouse_double_click(self, event):
+        i = self.subplotAt(event.pos)
+        if i is not None:
+            self.spikeScopeWindow = SpikeScopeWindow(self.dataset.filename,
+                                                     self.chans[i], self.dataset)
+            self.spikeScopeWindow.show()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import scipy.signal as signal
+
+from SliceCache import cachedCall, IMPORT_ATTRS, FILTER_ATTRS
+
+SAMPLE_RATE = 30000.    # Hz
+
+# band-pass applied to shank data; zero-phase, as in the single-shank viewer
+LOWCUT = 300.
+HIGHCUT = 9500.
+ORDER = 5
+
+class ShankView(object):
+    """
+    One shank's view of a dataset shared by several ShankPlotWindows.
+
+    The shank's channels are a contiguous block of rows of the dataset's
+    slices (see loadShanks()); slice_uv, slice_filtered and chan2slice_idx
+    cover only those rows (without copying them), as do the data limits.
+    sliceParams describes how the slices were produced (e.g. for keying
+    MinMaxPyramids in the slice cache). Other attributes are looked up on
+    the shared dataset.
+    """
+
+    def __init__(self, dataset, chans, sliceParams):
+        self.dataset = dataset
+        self.chans = chans
+        self.sliceParams = sliceParams
+        first = dataset.chan2slice_idx[chans[0]]
+        rows = slice(first, first + len(chans))
+        self.slice_uv = dataset.slice_uv[rows,:]
+        self.slice_filtered = dataset.slice_filtered[rows,:]
+        self.chan2slice_idx = dict((chan, dataset.chan2slice_idx[chan] - first)
+                                   for chan in chans)
+        self.slice_min = np.min(self.slice_uv)
+        self.slice_max = np.max(self.slice_uv)
+        self.slice_filtered_min = np.min(self.slice_filtered)
+        self.slice_filtered_max = np.max(self.slice_filtered)
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
+
+def filterRows(sos, data, out, rows):
+    out[rows,:] = signal.sosfiltfilt(sos, data[rows,:], axis=1)
+
+def loadShanks(dataset, geometry, shanks=None, nworkers=None):
+    """
+    imports the channels of the shanks of a ProbeGeometry (all of them by
+    default) from the dataset in one read, filters them with one worker per
+    shank, and returns a {shank: ShankView} dict
+
+    The slices are laid out shank by shank, so each ShankView (and whatever
+    is built over it, e.g. a MinMaxPyramid) covers only its shank's rows.
+    Single-shank windows load their shank this way too, so a shank is
+    filtered the same whichever way it is opened.
+    """
+    if shanks is None:
+        shanks = geometry.shanks
+    chans = dict((shank, sorted(geometry.shankChans[shank].tolist())) for shank in shanks)
+    allChans = sum([chans[shank] for shank in shanks], [])
+
+    def importAndFilter():
+        dataset.importSlice(chans=allChans)
+        nyq = SAMPLE_RATE / 2
+        sos = signal.butter(ORDER, [LOWCUT/nyq, HIGHCUT/nyq], btype='bandpass',
+                            output='sos')
+        # rows in shank order, whatever order the import returned them in
+        data = dataset.slice_uv[[dataset.chan2slice_idx[chan] for chan in allChans],:]
+        filtered = np.empty(data.shape)
+        bounds = np.cumsum([0] + [len(chans[shank]) for shank in shanks])
+        pool = ThreadPool(nworkers or len(shanks))
+        pool.map(lambda i: filterRows(sos, data, filtered,
+                                      slice(bounds[i], bounds[i+1])),
+                 range(len(shanks)))
+        pool.close()
+        dataset.slice_uv = data
+        dataset.chan2slice_idx = dict((chan, i) for i, chan in enumerate(allChans))
+        dataset.slice_min = np.min(data)
+        dataset.slice_max = np.max(data)
+        dataset.slice_filtered = filtered
+        dataset.slice_filtered_min = np.min(filtered)
+        dataset.slice_filtered_max = np.max(filtered)
+    params = {'lowcut': LOWCUT, 'highcut': HIGHCUT, 'order': ORDER}
+    cachedCall(dataset, 'loadShanks', importAndFilter, IMPORT_ATTRS + FILTER_ATTRS,
+               chans=allChans, params=params)
+
+    # each shank's rows are filtered on their own, so they are the same
+    #   whichever shanks were loaded along with them
+    sliceParams = dict(params, producer='loadShanks')
+    return dict((shank, ShankView(dataset, chans[shank], sliceParams)) for shank in shanks)
@@ -2,28 +2,29 @@
 
 from PyQt4 import QtCore, QtGui
 
-import os, sys, time, h5py
-sys.setrecursionlimit(10000) # this is necessary to mutually link >140 plot axes
+import os, sys, time
 
 import pyqtgraph as pg
 pg.setConfigOptions(antialias=True)
 
 import numpy as np
 
-import pickle, glob
-
 from SpikeScopeWindow import SpikeScopeWindow
+from ShankData import loadShanks
+from ProbeGeometry import probeGeometry
+from MinMaxPyramid import slicePyramid
+from ImpedanceIndex import loadImpedance, impedanceIndex
 from willowephys import WillowDataset
 
 ################
 
-def subplotIndex2rowColChan(subplotIndex, probeMap, shank):
+def subplotIndex2rowColChan(subplotIndex, geometry, shank):
     # here's some mangling that's necessary b.c. pyqtgraph plots subplots in
     #   column-major order
-    ncols = probeMap['ncols']
+    ncols = geometry.ncols
     row = subplotIndex // ncols
     col = subplotIndex % ncols
-    willowChan = probeMap[shank, row, col]
+    willowChan = geometry.channel(shank, row, col)
     return row, col, willowChan
 
 ####
@@ -193,43 +194,77 @@ class ScrollZoomPanel(QtGui.QScrollArea):
 
 class ClickablePlotItem(pg.PlotItem):
 
-    def __init__(self, dataset, chan, row, col, *args, **kwargs):
+    def __init__(self, dataset, chan, row, col, getPyramid, *args, **kwargs):
         pg.PlotItem.__init__(self, *args, **kwargs)
 
         self.dataset = dataset
-        self.chan = chan
-        self.slice_idx = self.dataset.chan2slice_idx[chan]
-        self.row = row
-        self.col = col
+        # traces are drawn as min/max envelopes of the visible range, at the
+        #   plot's width in pixels, and redrawn when that changes
+        self.getPyramid = getPyramid
+        self.pyramid = None
+        self.curve = None
+        self.xRanged = False
+        self.vb.sigXRangeChanged.connect(self.updateTrace)
+        self.vb.sigResized.connect(self.updateTrace)
         self.getAxis('left').setStyle(textFillLimits=[(3,0.05)], tickLength=5)
         self.getAxis('bottom').setStyle(tickLength=5)
-        self.setTitle(title='Row %d, Col %d, Chan %d' % (self.row, self.col, self.chan))
+        self.setChannel(chan, row, col)
 
         # install event filter for viewbox and axes items
         self.vb.installEventFilter(self)
         for axesDict in self.axes.values():
             axesDict['item'].installEventFilter(self)
 
+    def setChannel(self, chan, row, col):
+        """
+        points this plot at another channel (plots are recycled as their
+        rows scroll in and out of view); the trace is redrawn by the next
+        plotRaw() or plotFiltered()
+        """
+        self.chan = chan
+        self.slice_idx = self.dataset.chan2slice_idx[chan]
+        self.row = row
+        self.col = col
+        self.xRanged = False
+        self.setTitle(title='Row %d, Col %d, Chan %d' % (self.row, self.col, self.chan))
+
     def mouseDoubleClickEvent(self, event):
-        self.spikeScopeWindow = SpikeScopeWindow(self.dataset.filename, self.chan)
+        self.spikeScopeWindow = SpikeScopeWindow(self.dataset.filename, self.chan,
+                                                 self.dataset)
         self.spikeScopeWindow.show()
 
     def plotRaw(self):
-        self.clear()
-        self.plot(x=self.dataset.time_ms,
-                  y=self.dataset.slice_uv[self.slice_idx,:],
-                  pen={'color': (143,219,144), 'width': 0.2})
+        self.plotTrace(self.getPyramid('slice_uv'))
         self.setYRange(self.dataset.slice_min,
                        self.dataset.slice_max, padding=0.9)
 
     def plotFiltered(self):
-        self.clear()
-        self.plot(x=self.dataset.time_ms,
-                  y=self.dataset.slice_filtered[self.slice_idx],
-                  pen={'color': (143,219,144), 'width': 0.2})
+        self.plotTrace(self.getPyramid('slice_filtered'))
         self.setYRange(self.dataset.slice_filtered_min,
                        self.dataset.slice_filtered_max, padding=0.9)
 
+    def plotTrace(self, pyramid):
+        self.clear()
+        self.pyramid = pyramid
+        self.curve = self.plot(pen={'color': (143,219,144), 'width': 0.2})
+        self.vb.disableAutoRange(axis=pg.ViewBox.XAxis)
+        if not self.xRanged:
+            # the envelope only covers the view, so the view can't autorange
+            self.setXRange(self.dataset.timeMin, self.dataset.timeMax, padding=0)
+            self.xRanged = True
+        self.updateTrace()
+
+    def updateTrace(self, *args):
+        if self.pyramid is None:
+            return
+        t0, t1 = self.vb.viewRange()[0]
+        time_ms = self.dataset.time_ms
+        start = max(0, np.searchsorted(time_ms, t0) - 1)
+        stop = np.searchsorted(time_ms, t1) + 1
+        npix = max(100, int(self.vb.width()))
+        indices, values = self.pyramid.envelope(self.slice_idx, start, stop, npix)
+        self.curve.setData(x=time_ms[indices], y=values)
+
     def eventFilter(self, target, ev):
         if ev.type() == QtCore.QEvent.GraphicsSceneWheel:
             if ev.modifiers() == QtCore.Qt.ControlModifier:
@@ -243,59 +278,216 @@ class ClickablePlotItem(pg.PlotItem):
             return True
         return False
 
-class MultiPlotWidget(pg.GraphicsLayoutWidget):
+class ViewRangeController(QtCore.QObject):
+    """
+    Keeps the view ranges of a set of plots in step, instead of chaining
+    setXLink/setYLink from plot to plot.
+
+    A range change on any plot is recorded, and applied to all the other
+    plots in a single pass once control returns to the event loop, so a
+    burst of wheel events costs one update. Plots that are scrolled out of
+    view are left stale until they become visible again (see refresh()).
+    """
+
+    def __init__(self, view):
+        QtCore.QObject.__init__(self)
+        self.view = view        # the QGraphicsView showing the plots
+        self.plots = []
+        self.locked = True
+        self.range = None       # (xRange, yRange) all plots should show
+        self.applying = False
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.apply)
+
+    def subscribe(self, plotItem):
+        self.plots.append(plotItem)
+        plotItem.vb.sigRangeChanged.connect(
+            lambda vb, viewRange: self.rangeChanged(viewRange))
+
+    def rangeChanged(self, viewRange):
+        if self.applying or not self.locked:
+            return
+        self.range = [list(r) for r in viewRange]
+        self.timer.start(0)
+
+    def setLocked(self, locked):
+        self.locked = locked
+        shown = [plotItem for plotItem in self.plots if plotItem.isVisible()]
+        if locked and shown:
+            self.rangeChanged(shown[0].vb.viewRange())
+
+    def hold(self):
+        """
+        ignore range changes until release(), e.g. while plots are refilled
+        """
+        held = self.applying
+        self.applying = True
+        return held
 
-    def __init__(self, dataset, probeMap, shank, impedanceFile):
-        pg.GraphicsLayoutWidget.__init__(self)
+    def release(self, held):
+        self.applying = held
+
+    def sync(self, plotItem):
+        """
+        bring a plot that has just been (re)filled in line with the others
+        """
+        if self.locked and self.range is not None:
+            held = self.hold()
+            plotItem.vb.setRange(xRange=self.range[0], yRange=self.range[1],
+                                 padding=0)
+            self.release(held)
+
+    def refresh(self):
+        """
+        bring plots that have become visible up to date
+        """
+        if self.locked and self.range is not None:
+            self.timer.start(0)
+
+    def isVisible(self, plotItem):
+        visible = self.view.visibleRegion().boundingRect()
+        rect = self.view.mapFromScene(plotItem.sceneBoundingRect()).boundingRect()
+        return visible.intersects(rect)
+
+    def apply(self):
+        xRange, yRange = self.range
+        self.applying = True
+        for plotItem in self.plots:
+            if (plotItem.isVisible() and plotItem.vb.viewRange() != self.range
+                    and self.isVisible(plotItem)):
+                plotItem.vb.setRange(xRange=xRange, yRange=yRange, padding=0)
+        self.applying = False
+
+class MultiPlotWidget(pg.GraphicsView):
+    """
+    The grid of plots of a shank's channels, shown in a ScrollZoomPanel.
+
+    Only the rows in or near the visible part of the widget have plots;
+    as rows scroll out of view, their plots are recycled for the rows that
+    scroll in. So the number of plots, and the work of filling them, follows
+    the size of the viewport rather than that of the shank.
+    """
+
+    # rows materialized beyond each edge of the viewport
+    ROW_MARGIN = 2
+
+    def __init__(self, dataset, geometry, shank, impedanceFile):
+        pg.GraphicsView.__init__(self)
         self.dataset = dataset
-        self.probeMap = probeMap
+        self.geometry = geometry
         self.shank = shank
 
-        self.ncols = self.probeMap['ncols']
-        self.nrows = self.probeMap['nrows']
+        self.ncols = self.geometry.ncols
+        self.nrows = self.geometry.nrows
         self.nchannels = self.ncols * self.nrows
 
-        self.plotItems = []
-        self.locked = False
+        self.rows = {}          # row: [ClickablePlotItem] of the rows with plots
+        self.spareRows = []     # rows of plots scrolled out of view
+        self.filtered = True
+        self.axes = True
+        self.impedance = None
+        self.locked = True
+        self.pyramids = {}
+        self.rangeController = ViewRangeController(self)
 
-        self.initializePlots()
-        self.plotFiltered()
         self.applyImpedanceFile(impedanceFile)
 
         self.defaultHeight = 10000
         self.setDefaultHeight()
 
+    @property
+    def plotItems(self):
+        return [plotItem for row in sorted(self.rows) for plotItem in self.rows[row]]
+
     def setDefaultHeight(self):
         self.resize(self.width(), self.defaultHeight)
 
-    def initializePlots(self):
-        for i in range(self.nchannels):
-            row, col, willowChan = subplotIndex2rowColChan(i, self.probeMap, self.shank)
-            plotItem = ClickablePlotItem(self.dataset, willowChan, row, col)
-            self.addItem(plotItem)
-            self.plotItems.append(plotItem)
-            if i>=1: # link all plots together # TODO better way?
-                plotItem.setXLink(self.plotItems[i-1])
-                plotItem.setYLink(self.plotItems[i-1])
-            self.locked = True
-            if (i+1)%self.ncols==0:
-                self.nextRow()
+    def getPyramid(self, name):
+        # built (or loaded from the slice cache) once, shared by all plots
+        if name not in self.pyramids:
+            self.pyramids[name] = slicePyramid(self.dataset, name)
+        return self.pyramids[name]
+
+    def visibleRows(self):
+        """
+        returns the range of rows in or near the viewport of the scroll area
+        """
+        viewport = self.parentWidget()
+        if viewport is None:
+            top, bottom = 0, self.height()
+        else:
+            top = -self.y()
+            bottom = top + viewport.height()
+        rowHeight = max(1., self.height() / float(self.nrows))
+        first = max(0, int(top // rowHeight) - self.ROW_MARGIN)
+        last = min(self.nrows, int(np.ceil(bottom / rowHeight)) + self.ROW_MARGIN)
+        return first, last
+
+    def updateRows(self, *args):
+        """
+        gives plots to the rows that have come into view, taken from the rows
+        that have left it, and lays them out
+        """
+        first, last = self.visibleRows()
+        for row in self.rows.keys():
+            if not first <= row < last:
+                plotItems = self.rows.pop(row)
+                for plotItem in plotItems:
+                    plotItem.hide()
+                self.spareRows.append(plotItems)
+        held = self.rangeController.hold()
+        try:
+            for row in range(first, last):
+                if row not in self.rows:
+                    self.rows[row] = self.fillRow(row)
+            rowHeight = self.height() / float(self.nrows)
+            colWidth = self.width() / float(self.ncols)
+            for row, plotItems in self.rows.items():
+                for plotItem in plotItems:
+                    plotItem.setGeometry(QtCore.QRectF(plotItem.col*colWidth,
+                                            row*rowHeight, colWidth, rowHeight))
+        finally:
+            self.rangeController.release(held)
+        self.rangeController.refresh()
+
+    def fillRow(self, row):
+        plotItems = self.spareRows.pop() if self.spareRows else []
+        for i in range(self.ncols):
+            _, col, willowChan = subplotIndex2rowColChan(row*self.ncols + i,
+                                                         self.geometry, self.shank)
+            if i < len(plotItems):
+                plotItem = plotItems[i]
+                plotItem.setChannel(willowChan, row, col)
+                plotItem.show()
+            else:
+                plotItem = ClickablePlotItem(self.dataset, willowChan, row, col,
+                                             self.getPyramid)
+                self.addItem(plotItem)
+                self.rangeController.subscribe(plotItem)
+                plotItems.append(plotItem)
+            self.fillPlot(plotItem)
+        return plotItems
+
+    def fillPlot(self, plotItem):
+        if self.filtered:
+            plotItem.plotFiltered()
+        else:
+            plotItem.plotRaw()
+        plotItem.showAxis('left', show=self.axes)
+        plotItem.showAxis('bottom', show=self.axes)
+        if self.impedance is not None:
+            plotItem.setTitle(title='Row %d, Col %d, Chan %d, Z = %s' %
+                (plotItem.row, plotItem.col, plotItem.chan,
+                 self.impedance.labels[plotItem.chan]))
+        self.rangeController.sync(plotItem)
 
     def applyImpedanceFile(self, impedanceFile):
         self.impedanceFile = str(impedanceFile) if impedanceFile else False
         if self.impedanceFile:
-            f = h5py.File(self.impedanceFile)
-            impedanceMap = f['impedanceMeasurements']
+            self.impedance = loadImpedance(self.impedanceFile)
             for plotItem in self.plotItems:
-                willowChan = plotItem.chan
-                impedance = impedanceMap[willowChan]
-                if ((impedance > 1e6) or (impedance < 1e5)): # tweak this range as neeeded
-                    if self.filtered:
-                        plotItem.plotFiltered()
-                    else:
-                        plotItem.plotRaw()
-                plotItem.setTitle(title='Row %d, Col %d, Chan %d, Z = %.0f k' %
-                                    (plotItem.row, plotItem.col, willowChan, impedance/1000.))
+                self.fillPlot(plotItem)
 
     def toggleFiltered(self, filtered):
         if filtered:
@@ -304,43 +496,39 @@ class MultiPlotWidget(pg.GraphicsLayoutWidget):
             self.plotRaw()
 
     def plotRaw(self):
+        self.filtered = False
         for plotItem in self.plotItems:
             plotItem.plotRaw()
-        self.filtered = False
 
     def plotFiltered(self):
+        self.filtered = True
         for plotItem in self.plotItems:
             plotItem.plotFiltered()
-        self.filtered = True
 
     def toggleAxes(self, axes):
+        self.axes = axes
         for plotItem in self.plotItems:
             plotItem.showAxis('left', show=axes)
             plotItem.showAxis('bottom', show=axes)
 
     def toggleLock(self, lock):
-        if lock:
-            for i,plotItem in enumerate(self.plotItems):
-                if i>=1: # link all plots together, round-robin (is there a better way?)
-                    plotItem.setXLink(self.plotItems[i-1])
-                    plotItem.setYLink(self.plotItems[i-1])
-        else:
-            for plotItem in self.plotItems:
-                plotItem.setXLink(None)
-                plotItem.setYLink(None)
+        self.rangeController.setLocked(lock)
         self.locked = lock
 
+    def resizeEvent(self, ev):
+        pg.GraphicsView.resizeEvent(self, ev)
+        self.updateRows()
+
     def setDefaultRange(self, filtered=True):
         self.setDefaultHeight()
         dataMin = self.dataset.slice_filtered_min if filtered else self.dataset.slice_min
         dataMax = self.dataset.slice_filtered_max if filtered else self.dataset.slice_max
+        plotItems = self.plotItems
         if self.locked:
-            self.plotItems[0].setXRange(self.dataset.timeMin, self.dataset.timeMax)
-            self.plotItems[0].setYRange(dataMin, dataMax, padding=0.9)
-        else:
-            for plotItem in self.plotItems:
-                plotItem.setXRange(self.dataset.timeMin, self.dataset.timeMax)
-                plotItem.setYRange(dataMin, dataMax, padding=0.9)
+            plotItems = plotItems[:1]
+        for plotItem in plotItems:
+            plotItem.setXRange(self.dataset.timeMin, self.dataset.timeMax)
+            plotItem.setYRange(dataMin, dataMax, padding=0.9)
 
     def setImpedanceFile(self, impedanceFile):
         pass
@@ -348,48 +536,59 @@ class MultiPlotWidget(pg.GraphicsLayoutWidget):
     def wheelEvent(self, ev):
         # this overrides the wheelEvent behavior
         if ev.modifiers() == QtCore.Qt.ControlModifier:
-            return pg.GraphicsLayoutWidget.wheelEvent(self, ev)
+            return pg.GraphicsView.wheelEvent(self, ev)
         elif ev.modifiers() == (QtCore.Qt.ControlModifier | QtCore.Qt.ShiftModifier):
-            return pg.GraphicsLayoutWidget.wheelEvent(self, ev)
+            return pg.GraphicsView.wheelEvent(self, ev)
         else:
             ev.ignore() # propagate event to parent (scrollzoompanel)
 
 class ShankPlotWindow(QtGui.QWidget):
 
-    def __init__(self, dataset, probeMap, shank):
+    def __init__(self, dataset, geometry, shank, loaded=False, gl=False):
         QtGui.QWidget.__init__(self)
 
-        # look for impedance files in the snapshot directory
+        # use the impedance measurement taken closest to the snapshot
         snapshotFilename = dataset.filename
         snapshotDir = os.path.dirname(snapshotFilename)
-        impedanceFiles = glob.glob(os.path.join(snapshotDir, 'impedance*.h5'))
-        if len(impedanceFiles) > 0:
-            impedanceFile = impedanceFiles[-1] # most recent impedance measurement is used
-        else:
-            impedanceFile = False
+        impedanceFile = impedanceIndex(snapshotDir).nearest(snapshotFilename) or False
 
         # filter data, find min and max for *this shank's channels only*
-        shankChannels = []
-        for item in probeMap:
-            if item[0] == shank: shankChannels.append(probeMap[item])
-        dataset.importSlice(chans=shankChannels)
-        dataset.filterSlice()
-
-        self.multiPlotWidget = MultiPlotWidget(dataset, probeMap, shank, impedanceFile)
+        #   (unless that was already done for all shanks), with the same
+        #   filter either way, see ShankData
+        if not loaded:
+            dataset = loadShanks(dataset, geometry, [shank])[shank]
+
+        if gl:
+            # all plots drawn by a single GL canvas, which scrolls by itself
+            from ShankCanvas import ShankCanvas
+            self.multiPlotWidget = ShankCanvas(dataset, geometry, shank, impedanceFile)
+            self.scrollZoomPanel = self.multiPlotWidget
+            plotPanel = self.multiPlotWidget.native
+        else:
+            self.multiPlotWidget = MultiPlotWidget(dataset, geometry, shank, impedanceFile)
+            self.scrollZoomPanel = ScrollZoomPanel(self.multiPlotWidget)
+            self.scrollZoomPanel.verticalScrollBar().valueChanged.connect(
+                self.multiPlotWidget.updateRows)
+            plotPanel = self.scrollZoomPanel
 
         self.controlPanel = ControlPanel(dataset, impedanceFile)
-        self.scrollZoomPanel = ScrollZoomPanel(self.multiPlotWidget)
 
         # signal connections
         self.controlPanel.filterToggled.connect(self.multiPlotWidget.toggleFiltered)
-        self.controlPanel.lockToggled.connect(self.multiPlotWidget.toggleLock)
+        if gl:
+            # the GL canvas has a single range for all plots
+            self.controlPanel.lockCheckbox.setEnabled(False)
+            self.controlPanel.lockCheckbox.setToolTip(
+                'Plots are always locked together when drawn with GL')
+        else:
+            self.controlPanel.lockToggled.connect(self.multiPlotWidget.toggleLock)
         self.controlPanel.axesToggled.connect(self.multiPlotWidget.toggleAxes)
         self.controlPanel.defaultSelected.connect(self.multiPlotWidget.setDefaultRange)
         self.controlPanel.impedanceFileSelected.connect(self.multiPlotWidget.applyImpedanceFile)
 
         layout = QtGui.QVBoxLayout()
         layout.addWidget(self.controlPanel)
-        layout.addWidget(self.scrollZoomPanel)
+        layout.addWidget(plotPanel)
         self.setLayout(layout)
 
         self.setWindowTitle('Shank %d (%s)' % (shank, dataset.filename))
@@ -405,24 +604,38 @@ class ShankPlotWindow(QtGui.QWidget):
 
 if __name__=='__main__':
     if len(sys.argv) < 3:
-        print 'Usage: ./ShankPlot.py <snapshot_filename.h5> <probeMap_level2.p> [shank]'
+        print 'Usage: ./ShankPlot.py <snapshot_filename.h5> <probeMap_level2.p> [shank | all] [gl]'
         sys.exit(1)
     else:
         snapshot_filename = sys.argv[1]
         probeMap_filename = sys.argv[2]
+        gl = sys.argv[-1] == 'gl'
+        if len(sys.argv) > 3 and sys.argv[3] == 'gl':
+            sys.argv.pop(3)
         if len(sys.argv)==3:
             shank = 0
+        elif sys.argv[3] == 'all':
+            shank = None
         else:
             shank = int(sys.argv[3])
 
     dataset = WillowDataset(snapshot_filename)
 
-    probeMap = pickle.load(open(probeMap_filename, 'rb')) # (shank, col, row) : willowChan
+    geometry = probeGeometry(probeMap_filename)
 
 
     ####
 
     app = QtGui.QApplication(sys.argv)
-    mainWindow = ShankPlotWindow(dataset, probeMap, shank)
-    mainWindow.show()
+    if shank is None:
+        # one window per shank, all sharing a single read of the dataset
+        shankViews = loadShanks(dataset, geometry)
+        windows = []
+        for shank in geometry.shanks:
+            windows.append(ShankPlotWindow(shankViews[shank], geometry, shank,
+                                           loaded=True, gl=gl))
+            windows[-1].show()
+    else:
+        mainWindow = ShankPlotWindow(dataset, geometry, shank, gl=gl)
+        mainWindow.show()
     app.exec_()
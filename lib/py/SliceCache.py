@@ -0,0 +1,183 @@
+#!/usr/bin/env python2
+
+import os, time, shutil, hashlib, pickle, tempfile, warnings
+
+import numpy as np
+
+CACHE_DIRNAME = '.slicecache'
+CACHE_BUDGET = 4*2**30      # bytes
+# eviction shrinks the cache to this fraction of its budget, so the next
+#   few stores don't each need to evict again
+EVICT_TARGET = 0.9
+# the running size of the cache is re-measured at least this often (other
+#   processes add entries too), in seconds
+RESCAN_INTERVAL = 60.
+
+# arrays smaller than this are pickled along with the other attributes,
+#   rather than given their own memory-mapped file
+MIN_MAPPED_SIZE = 2**16
+
+class SliceCache(object):
+    """
+    Persistent cache of data derived from a snapshot (e.g. imported, scaled
+    and filtered slices), shared by all analysis programs.
+
+    Entries live in a directory next to the snapshot, one subdirectory per
+    entry. Large arrays are stored as .npy files and memory-mapped when an
+    entry is loaded, so a cache hit costs neither a read of the snapshot nor
+    any filtering. Entries are keyed by the snapshot's path, size and mtime,
+    along with a description of what was computed (channels, sample range,
+    filter parameters, ...). When the cache grows past its budget, the least
+    recently used entries are evicted. Stores keep a running total of the
+    cache's size, so the cache directory is only walked to evict, or every
+    RESCAN_INTERVAL seconds.
+    """
+
+    def __init__(self, snapshotFilename, cacheDir=None, budget=CACHE_BUDGET):
+        self.snapshotFilename = os.path.abspath(snapshotFilename)
+        if cacheDir is None:
+            cacheDir = os.path.join(os.path.dirname(self.snapshotFilename),
+                                    CACHE_DIRNAME)
+        self.cacheDir = cacheDir
+        self.budget = budget
+        self.size = None        # running total of the entries' sizes
+        self.scanTime = None    # time of the last walk of the cache directory
+
+    def key(self, name, chans=None, start=None, stop=None, params=None):
+        st = os.stat(self.snapshotFilename)
+        if chans is not None:
+            chans = tuple(int(c) for c in chans)
+        if params is not None:
+            params = tuple(sorted(params.items()))
+        ident = repr((self.snapshotFilename, st.st_size, st.st_mtime,
+                      name, chans, start, stop, params))
+        return hashlib.sha1(ident).hexdigest()
+
+    def entryDir(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.entryDir(key), 'attrs.p'))
+
+    def load(self, key):
+        """
+        returns the dict of attributes stored under key, with large arrays
+        memory-mapped (copy-on-write), or None on a miss
+        """
+        if not self.has(key):
+            return None
+        d = self.entryDir(key)
+        attrs = pickle.load(open(os.path.join(d, 'attrs.p'), 'rb'))
+        for name in os.listdir(d):
+            if name.endswith('.npy'):
+                attrs[name[:-4]] = np.load(os.path.join(d, name), mmap_mode='c')
+        os.utime(d, None)   # mark as recently used
+        return attrs
+
+    def store(self, key, attrs):
+        """
+        stores a dict of attributes under key. the entry is written to a
+        temporary directory first, so readers never see a partial entry.
+        """
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        tmp = tempfile.mkdtemp(dir=self.cacheDir, prefix='tmp')
+        try:
+            small = {}
+            for name, value in attrs.items():
+                if isinstance(value, np.ndarray) and value.size >= MIN_MAPPED_SIZE:
+                    np.save(os.path.join(tmp, name + '.npy'), value)
+                else:
+                    small[name] = value
+            pickle.dump(small, open(os.path.join(tmp, 'attrs.p'), 'wb'),
+                        pickle.HIGHEST_PROTOCOL)
+            size = self.entrySize(tmp)
+            os.rename(tmp, self.entryDir(key))
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        if (self.size is None or self.size + size > self.budget or
+                time.time() - self.scanTime > RESCAN_INTERVAL):
+            self.evict()
+        else:
+            self.size += size
+
+    def remove(self, key):
+        shutil.rmtree(self.entryDir(key), ignore_errors=True)
+
+    def entrySize(self, d):
+        return sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d))
+
+    def evict(self):
+        """
+        measures the cache; if it is over budget, removes least recently used
+        entries until it is down to EVICT_TARGET of the budget
+        """
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            d = os.path.join(self.cacheDir, name)
+            if name.startswith('tmp') or not os.path.isdir(d):
+                continue
+            entries.append((os.path.getmtime(d), self.entrySize(d), d))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        if total > self.budget:
+            while entries and total > EVICT_TARGET*self.budget:
+                _, size, d = entries.pop(0)
+                shutil.rmtree(d, ignore_errors=True)
+                total -= size
+        self.size = total
+        self.scanTime = time.time()
+
+# cache directory: SliceCache
+_caches = {}
+
+def sliceCache(snapshotFilename):
+    """
+    returns this process's (shared) SliceCache of a snapshot, so that its
+    running size is kept across calls
+    """
+    cache = SliceCache(snapshotFilename)
+    if cache.cacheDir not in _caches:
+        _caches[cache.cacheDir] = cache
+    return _caches[cache.cacheDir]
+
+# attributes set by WillowDataset.importSlice and by filterSlice
+IMPORT_ATTRS = ['slice_uv', 'chan2slice_idx', 'time_ms', 'timeMin', 'timeMax',
+                'slice_nsamples', 'slice_min', 'slice_max']
+FILTER_ATTRS = ['slice_filtered', 'slice_filtered_min', 'slice_filtered_max']
+
+def cachedCall(dataset, name, compute, attrs, chans=None, start=None, stop=None,
+               params=None, cache=None):
+    """
+    calls compute(), which sets attributes of dataset (e.g. importSlice
+    followed by filterSlice), unless its result is already cached; in that
+    case, the dataset's attributes are restored from the cache instead.
+    attrs names the attributes that make up the result (e.g. IMPORT_ATTRS +
+    FILTER_ATTRS); an entry lacking any of them is recomputed. the arguments
+    after attrs identify what compute() does.
+
+    failing to read or write the cache (e.g. a read-only snapshot directory)
+    only costs the computation, and is reported as a warning.
+    """
+    if cache is None:
+        cache = sliceCache(dataset.filename)
+    try:
+        key = cache.key(name, chans, start, stop, params)
+        stored = cache.load(key)
+    except (IOError, OSError) as e:
+        warnings.warn('Could not read cached %s: %s' % (name, e))
+        key, stored = None, None
+    if stored is not None and all(attr in stored for attr in attrs):
+        for attr in attrs:
+            setattr(dataset, attr, stored[attr])
+        return
+    if stored is not None:
+        cache.remove(key)   # e.g. from an older version of the caller
+    compute()
+    result = dict((attr, getattr(dataset, attr)) for attr in attrs)
+    if key is not None:
+        try:
+            cache.store(key, result)
+        except (IOError, OSError) as e:
+            warnings.warn('Could not cache %s: %s' % (name, e))
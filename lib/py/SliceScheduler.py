@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+
+import threading
+
+from PyQt4 import QtCore
+
+# a selection must be left alone for this long before it is loaded
+DEBOUNCE_MS = 150
+
+class Cancelled(Exception):
+    pass
+
+class SliceScheduler(QtCore.QObject):
+    """
+    Loads slices of a snapshot on a worker thread, so the GUI stays
+    responsive while the user scrubs through time.
+
+    Only the latest request matters: a request cancels the one being worked
+    on (at its next call to checkCancelled()), and is itself only started
+    once no newer request has come in for DEBOUNCE_MS. The worker has its
+    own dataset; the attributes a compute function sets on it (slice_uv,
+    slice_filtered, slice_activity, ...) are handed over to the GUI thread
+    by the sliceReady signal.
+    """
+
+    sliceReady = QtCore.pyqtSignal(int, int, object)   # start, stop, attrs
+    _computed = QtCore.pyqtSignal(int, int, int, object)
+
+    def __init__(self, dataset, compute, delay=DEBOUNCE_MS):
+        QtCore.QObject.__init__(self)
+        self.dataset = dataset      # for the worker thread only
+        self.compute = compute
+        self.initial = dict(dataset.__dict__)
+
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.pending = None
+        self.computeLock = threading.Lock()
+
+        self.latest = None
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.submit)
+        self._computed.connect(self.deliver)
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, start, stop):
+        """
+        schedules loading of samples [start, stop), superseding all earlier
+        requests
+        """
+        with self.cond:
+            self.generation += 1
+            self.pending = None
+        self.latest = (start, stop)
+        self.timer.start()
+
+    def submit(self):
+        with self.cond:
+            self.pending = (self.generation,) + self.latest
+            self.cond.notify()
+
+    def load(self, start, stop):
+        """
+        loads samples [start, stop) right away, on the calling thread, and
+        returns the new attributes
+        """
+        with self.cond:
+            self.generation += 1
+            self.pending = None
+        with self.computeLock:
+            self.compute(self.dataset, start, stop, lambda: None)
+            return self.attributes()
+
+    def attributes(self):
+        return dict((attr, value) for attr, value in self.dataset.__dict__.items()
+                    if attr not in self.initial or self.initial[attr] is not value)
+
+    def checkCancelled(self, generation):
+        if generation != self.generation:
+            raise Cancelled()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                generation, start, stop = self.pending
+                self.pending = None
+            with self.computeLock:
+                try:
+                    self.compute(self.dataset, start, stop,
+                                 lambda: self.checkCancelled(generation))
+                    self.checkCancelled(generation)
+                except Cancelled:
+                    continue
+                except Exception as e:
+                    print 'Could not load samples %d-%d: %s' % (start, stop, e)
+                    continue
+                attrs = self.attributes()
+            self._computed.emit(generation, start, stop, attrs)
+            # loaders that can guess what comes next get to load it meanwhile
+            prefetch = getattr(self.compute, 'prefetch', None)
+            if prefetch is not None:
+                with self.computeLock:
+                    try:
+                        prefetch(self.dataset, lambda: self.checkCancelled(generation))
+                    except Cancelled:
+                        pass
+                    except Exception as e:
+                        print 'Could not prefetch: %s' % e
+
+    def deliver(self, generation, start, stop, attrs):
+        # on the GUI thread; results superseded on the way are dropped
+        if generation == self.generation:
+            self.sliceReady.emit(start, stop, attrs)
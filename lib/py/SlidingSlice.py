@@ -0,0 +1,301 @@
+#!/usr/bin/env python2
+
+from collections import OrderedDict
+
+import numpy as np
+import scipy.signal as signal
+
+from willowephys import WillowDataset
+
+from ShankData import SAMPLE_RATE, LOWCUT, HIGHCUT, ORDER
+from SnapshotReader import NCHANNELS
+from SliceCache import sliceCache
+
+BLOCK_SAMPLES = 1250        # TimeScrubber's step
+PAD_SAMPLES = 1500          # filter warm-up on each side of a block (50 ms)
+SEGMENT_BLOCKS = 24         # blocks per SliceCache entry (one 1 s window)
+BLOCK_BUDGET = 512*2**20    # bytes of blocks kept
+# longer windows are shown from the ActivityOverview, if there is one
+FULLRATE_MAX_SAMPLES = 60000
+
+class SlidingSliceLoader(object):
+    """
+    A compute function for SliceScheduler that assembles windows of a
+    snapshot from fixed-size blocks of samples.
+
+    Each block is imported and band-pass filtered on its own, with
+    PAD_SAMPLES of context on each side so the filter settles before the
+    block starts (and the zero-phase pass before it ends). Blocks are kept
+    in an LRU cache, so sliding the window by a step only reads and filters
+    the newly exposed block, and going back and forth reads nothing. After
+    each window, the next block in the direction of travel is prefetched.
+
+    Blocks are imported a segment of SEGMENT_BLOCKS at a time, which is
+    kept in the snapshot's SliceCache (all probe channels, raw and
+    filtered), so later sessions, and traces of channels that come into
+    view later, are served without reading or filtering the snapshot. The
+    prefetch of the first block of a segment imports the whole segment.
+
+    Only the probe's channels are read, in two tiers: all of them contribute
+    to slice_activity (the RMS of the filtered window, normalized to the
+    most active channel) and to the virtual reference, but full-rate traces
+    are only kept for the channels being plotted (see setTraceChans()).
+    Traces of channels that come into view are filled in on the next call.
+
+    The window's attributes are set on the dataset as importSlice() and
+    filterAndCalculateActivitySlice() would, with slice_uv and
+    slice_filtered holding the plotted channels (see chan2slice_idx), and
+    slice_activity indexed by channel. slice_reference and
+    slice_reference_filtered are the mean of refChans, or None. slice_x
+    holds the time of each sample in ms from the start of the window, and
+    time_ms from the start of the snapshot.
+
+    Windows longer than FULLRATE_MAX_SAMPLES are taken from an overview
+    (see ActivityOverview.window()) when one is given, and are marked
+    with slice_decimated.
+    """
+
+    def __init__(self, probeChans, refChans=None, overview=None,
+                 blockSize=BLOCK_SAMPLES, pad=PAD_SAMPLES, budget=BLOCK_BUDGET):
+        self.probeChans = sorted(probeChans)
+        self.probeIdx = dict((chan, i) for i, chan in enumerate(self.probeChans))
+        self.refChans = sorted(refChans) if refChans is not None and len(refChans) else None
+        self.traceChans = []
+        self.overview = overview
+        self.blockSize = blockSize
+        self.pad = pad
+        self.budget = budget
+        self.blocks = OrderedDict()     # block index: dict of ss, ref, traces
+        self.nbytes = 0
+        self.reader = None              # dataset the blocks are imported with
+        self.cache = None               # SliceCache of the snapshot
+        self.segment = None             # (index, uv, filtered) of the last segment
+        nyq = SAMPLE_RATE / 2
+        self.sos = signal.butter(ORDER, [LOWCUT/nyq, HIGHCUT/nyq], btype='bandpass',
+                                 output='sos')
+        self.window = None
+        self.direction = 1
+
+    def setTraceChans(self, chans):
+        """
+        sets the channels to keep full-rate traces of (may be called from
+        another thread; takes effect on the next window)
+        """
+        self.traceChans = sorted(set(chans))
+
+    def __call__(self, dataset, start, stop, checkCancelled):
+        if self.reader is None:
+            self.reader = WillowDataset(dataset.filename)
+            self.cache = sliceCache(dataset.filename)
+        if self.window is not None and start != self.window[0]:
+            self.direction = 1 if start > self.window[0] else -1
+        traceChans = self.traceChans
+        if self.overview is not None and stop - start > FULLRATE_MAX_SAMPLES:
+            for attr, value in self.overview.window(start, stop, traceChans).items():
+                setattr(dataset, attr, value)
+            self.window = None      # nothing to prefetch
+            return
+        first = start // self.blockSize
+        last = (stop - 1) // self.blockSize + 1
+        self.fillTraces(first, last, traceChans)
+        checkCancelled()
+        blocks = []
+        for b in range(first, last):
+            blocks.append(self.block(b, traceChans))
+            checkCancelled()
+        self.window = (start, stop)
+        offset = first * self.blockSize
+        window = slice(start - offset, stop - offset)
+        nsamples = stop - start
+
+        def assemble(parts):
+            return np.concatenate(parts, axis=-1)[...,window]
+
+        if traceChans:
+            uv = assemble([np.array([block['traces'][chan][0] for chan in traceChans])
+                           for block in blocks])
+            filtered = assemble([np.array([block['traces'][chan][1] for chan in traceChans])
+                                 for block in blocks])
+        else:
+            uv = filtered = np.zeros((0, nsamples))
+        dataset.slice_uv = uv
+        dataset.slice_filtered = filtered
+        dataset.slice_nsamples = nsamples
+        dataset.slice_x = np.arange(nsamples) * 1000. / SAMPLE_RATE
+        dataset.slice_decimated = False
+        dataset.chan2slice_idx = dict((chan, i) for i, chan in enumerate(traceChans))
+        dataset.time_ms = (np.arange(nsamples) + start) * 1000. / SAMPLE_RATE
+        dataset.timeMin = dataset.time_ms[0]
+        dataset.timeMax = dataset.time_ms[-1]
+        # data limits over all probe channels, as of whole blocks
+        dataset.slice_min = min(block['limits'][0] for block in blocks)
+        dataset.slice_max = max(block['limits'][1] for block in blocks)
+        dataset.slice_filtered_min = min(block['limits'][2] for block in blocks)
+        dataset.slice_filtered_max = max(block['limits'][3] for block in blocks)
+        if self.refChans is not None:
+            dataset.slice_reference = assemble([block['ref'][0] for block in blocks])
+            dataset.slice_reference_filtered = assemble([block['ref'][1] for block in blocks])
+        else:
+            dataset.slice_reference = dataset.slice_reference_filtered = None
+
+        # activity from the blocks' sums of squares, the edge blocks weighted
+        #   by how much of them is in the window
+        ss = np.zeros(len(self.probeChans))
+        for b, block in zip(range(first, last), blocks):
+            b0 = b * self.blockSize
+            b1 = b0 + block['nsamples']
+            ss += block['ss'] * (min(b1, stop) - max(b0, start)) / float(b1 - b0)
+        rms = np.sqrt(ss / nsamples)
+        activity = np.zeros(NCHANNELS)
+        activity[self.probeChans] = rms / max(np.max(rms), 1e-12)
+        dataset.slice_activity = activity
+
+    def prefetch(self, dataset, checkCancelled):
+        """
+        loads the block just past the current window, in the direction the
+        window last moved
+        """
+        if self.window is None:
+            return
+        start, stop = self.window
+        if self.direction > 0:
+            b = (stop - 1) // self.blockSize + 1
+        else:
+            b = start // self.blockSize - 1
+        if 0 <= b * self.blockSize < self.reader.nsamples:
+            self.block(b, self.traceChans)
+
+    def block(self, b, traceChans):
+        if b in self.blocks:
+            block = self.blocks.pop(b)
+            self.blocks[b] = block      # most recently used
+            missing = [chan for chan in traceChans if chan not in block['traces']]
+            if missing:
+                stored = self.storedBlock(b)
+                if stored is not None:
+                    uv, filtered = stored
+                    idx = self.probeIdx
+                else:
+                    uv, filtered, idx = self.importBlocks(b, b+1, missing)
+                self.addTraces(block, missing, uv, filtered, idx)
+            return block
+
+        stored = self.storedBlock(b)
+        if stored is None:
+            self.importSegment(b // SEGMENT_BLOCKS)
+            stored = self.storedBlock(b)
+        uv, filtered = stored
+        block = {'nsamples': uv.shape[1], 'traces': {}, 'ref': None}
+        block['ss'] = np.einsum('ij,ij->i', filtered, filtered)
+        block['limits'] = (np.min(uv), np.max(uv), np.min(filtered), np.max(filtered))
+        self.nbytes += block['ss'].nbytes
+        if self.refChans is not None:
+            refRows = [self.probeIdx[chan] for chan in self.refChans]
+            block['ref'] = (uv[refRows,:].mean(axis=0), filtered[refRows,:].mean(axis=0))
+            self.nbytes += 2 * block['ref'][0].nbytes
+        self.addTraces(block, traceChans, uv, filtered, self.probeIdx)
+        self.blocks[b] = block
+        while self.nbytes > self.budget and len(self.blocks) > 1:
+            _, old = self.blocks.popitem(last=False)
+            self.nbytes -= old['ss'].nbytes
+            if old['ref'] is not None:
+                self.nbytes -= 2 * old['ref'][0].nbytes
+            for u, f in old['traces'].values():
+                self.nbytes -= u.nbytes + f.nbytes
+        return block
+
+    def segmentKey(self, seg):
+        start = seg * SEGMENT_BLOCKS * self.blockSize
+        return self.cache.key('SlidingSliceLoader', self.probeChans, start,
+                              start + SEGMENT_BLOCKS * self.blockSize,
+                              {'pad': self.pad, 'lowcut': LOWCUT, 'highcut': HIGHCUT,
+                               'order': ORDER, 'blockSize': self.blockSize})
+
+    def storedBlock(self, b):
+        """
+        returns the raw and filtered samples of all probe channels in block
+        b from the last segment or from the slice cache (memory-mapped), or
+        None
+        """
+        seg = b // SEGMENT_BLOCKS
+        if self.segment is None or self.segment[0] != seg:
+            try:
+                attrs = self.cache.load(self.segmentKey(seg))
+            except (IOError, OSError):
+                attrs = None
+            if attrs is None:
+                return None
+            self.segment = (seg, attrs['uv'], attrs['filtered'])
+        _, uv, filtered = self.segment
+        j = (b - seg * SEGMENT_BLOCKS) * self.blockSize
+        if j >= uv.shape[1]:
+            return None
+        return uv[:,j:j+self.blockSize], filtered[:,j:j+self.blockSize]
+
+    def importSegment(self, seg):
+        """
+        imports and filters all probe channels of a segment, and stores it
+        in the slice cache
+        """
+        first = seg * SEGMENT_BLOCKS
+        uv, filtered, idx = self.importBlocks(first, first + SEGMENT_BLOCKS,
+                                              self.probeChans)
+        rows = [idx[chan] for chan in self.probeChans]
+        uv, filtered = uv[rows,:], filtered[rows,:]
+        self.segment = (seg, uv, filtered)
+        try:
+            self.cache.store(self.segmentKey(seg), {'uv': uv, 'filtered': filtered})
+        except (IOError, OSError) as e:
+            print 'Could not cache segment %d: %s' % (seg, e)
+
+    def fillTraces(self, first, last, chans):
+        """
+        adds the traces of chans to the cached blocks in [first, last) that
+        lack them, from the slice cache or else with a single read
+        """
+        cached = []
+        for b in range(first, last):
+            if b not in self.blocks:
+                continue
+            block = self.blocks[b]
+            missing = [chan for chan in chans if chan not in block['traces']]
+            if not missing:
+                continue
+            stored = self.storedBlock(b)
+            if stored is not None:
+                self.addTraces(block, missing, stored[0], stored[1], self.probeIdx)
+            else:
+                cached.append(b)
+        missing = sorted(set(chan for b in cached for chan in chans
+                             if chan not in self.blocks[b]['traces']))
+        if len(cached) < 2 or not missing:
+            return
+        first, last = cached[0], cached[-1] + 1
+        uv, filtered, idx = self.importBlocks(first, last, missing)
+        for b in cached:
+            block = self.blocks[b]
+            j = (b - first) * self.blockSize
+            k = j + block['nsamples']
+            self.addTraces(block, [chan for chan in missing if chan not in block['traces']],
+                           uv[:,j:k], filtered[:,j:k], idx)
+
+    def addTraces(self, block, chans, uv, filtered, idx):
+        for chan in chans:
+            trace = (uv[idx[chan],:].copy(), filtered[idx[chan],:].copy())
+            block['traces'][chan] = trace
+            self.nbytes += trace[0].nbytes + trace[1].nbytes
+
+    def importBlocks(self, first, last, chans):
+        """
+        returns the raw and filtered samples of blocks [first, last) for
+        chans, and the row of each channel in them
+        """
+        start = first * self.blockSize
+        stop = min(last * self.blockSize, self.reader.nsamples)
+        a = max(0, start - self.pad)
+        z = min(self.reader.nsamples, stop + self.pad)
+        self.reader.importSlice(a, z, chans=chans)
+        data = self.reader.slice_uv
+        filtered = signal.sosfiltfilt(self.sos, data, axis=1)
+        return (data[:,start-a:stop-a], filtered[:,start-a:stop-a],
+                dict(self.reader.chan2slice_idx))
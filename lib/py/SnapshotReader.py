@@ -0,0 +1,169 @@
+#!/usr/bin/env python2
+
+import sys, threading, Queue
+
+import numpy as np
+import h5py
+
+MICROVOLTS_PER_COUNT = 0.195
+NCHANNELS = 1024
+
+class SnapshotReader(object):
+    """
+    Streams data for a subset of channels out of a Willow snapshot, without
+    ever loading the whole snapshot into memory.
+
+    Samples are read from the HDF5 file as hyperslabs of chunkSize samples.
+    Sequential reads with read() are served by a background thread, which
+    prefetches up to prefetchDepth chunks ahead of the cursor into a bounded
+    queue. readRange() does a one-off synchronous read instead. Errors in
+    the background thread are re-raised by read().
+
+    All data is returned in microvolts with shape (nchans, nsamples); samples
+    beyond the end of the snapshot are padded with zeros.
+    """
+
+    def __init__(self, filename, chunkSize=6000, prefetchDepth=8):
+        self.filename = filename
+        self.fileObject = h5py.File(filename, 'r')
+        self.dset = self.fileObject['channel_data']
+        self.nsamples = len(self.fileObject['sample_index'])
+        self.sampleRange = [0, self.nsamples]
+        # unsigned counts are offset-binary
+        self.offset = 2**15 if self.dset.dtype.kind == 'u' else 0
+
+        self.chunkSize = chunkSize
+        self.prefetchDepth = prefetchDepth
+
+        self.chans = np.arange(NCHANNELS)
+        self.cursor = 0
+
+        self._thread = None
+        self._stopEvent = None
+        self._queue = None
+        self._chunk = None
+        self._chunkStart = 0
+
+    def readRange(self, start, stop, chans=None):
+        """
+        read samples [start, stop) of chans (defaults to the current channels)
+        """
+        if chans is None:
+            chans = self.chans
+        chans = np.asarray(chans)
+        out = np.zeros((len(chans), stop-start))
+        stop_valid = min(stop, self.nsamples)
+        if stop_valid > start and len(chans) > 0:
+            c0, c1 = chans.min(), chans.max() + 1
+            raw = self._readHyperslab(start, stop_valid, c0, c1)
+            if (c1 - c0) != len(chans) or np.any(chans[:-1] > chans[1:]):
+                raw = raw[:,chans-c0]
+            out[:,:stop_valid-start] = raw.T
+            out[:,:stop_valid-start] -= self.offset
+            out[:,:stop_valid-start] *= MICROVOLTS_PER_COUNT
+        return out
+
+    def _readHyperslab(self, start, stop, c0, c1):
+        """
+        returns raw counts of channels [c0, c1) with shape (stop-start, c1-c0)
+        """
+        if self.dset.ndim == 2:
+            return self.dset[start:stop, c0:c1]
+        # channel_data is stored flat, as consecutive 1024-channel samples:
+        #   select a (c1-c0)-wide block out of every sample
+        count = stop - start
+        width = c1 - c0
+        fspace = self.dset.id.get_space()
+        fspace.select_hyperslab((start*NCHANNELS + c0,), (count,),
+                                stride=(NCHANNELS,), block=(width,))
+        mspace = h5py.h5s.create_simple((count*width,))
+        raw = np.empty(count*width, dtype=self.dset.dtype)
+        self.dset.id.read(mspace, fspace, raw)
+        return raw.reshape((count, width))
+
+    def setChannels(self, chans):
+        self.chans = np.asarray(chans)
+        self._stopPrefetch()
+
+    def setChunkSize(self, chunkSize):
+        """
+        read chunkSize samples at a time; restarts the prefetcher, which
+        keeps the chunk size it was started with
+        """
+        if chunkSize != self.chunkSize:
+            self._stopPrefetch()
+            self.chunkSize = chunkSize
+
+    def seek(self, sample):
+        """
+        move the read cursor. short forward skips are served from chunks that
+        have already been prefetched; anything else restarts the prefetcher.
+        """
+        horizon = self._chunkStart + self.prefetchDepth*self.chunkSize
+        if not (self._thread and (self._chunkStart <= sample < horizon)):
+            self._stopPrefetch()
+        self.cursor = sample
+
+    def read(self, n):
+        """
+        read the next n samples of the current channels, starting at the cursor
+        """
+        if self._thread is None:
+            self._startPrefetch(self.cursor, self.chunkSize)
+        out = np.zeros((len(self.chans), n))
+        filled = 0
+        while filled < n and (self.cursor + filled) < self.nsamples:
+            pos = self.cursor + filled
+            while (self._chunk is None or
+                    pos >= self._chunkStart + self._chunk.shape[1]):
+                self._chunkStart, self._chunk = self._queue.get()
+                if self._chunkStart is None:
+                    # the prefetcher failed; _chunk is its sys.exc_info()
+                    excType, excValue, excTraceback = self._chunk
+                    self._stopPrefetch()
+                    raise excType, excValue, excTraceback
+            offset = pos - self._chunkStart
+            take = min(n - filled, self._chunk.shape[1] - offset)
+            out[:,filled:filled+take] = self._chunk[:,offset:offset+take]
+            filled += take
+        self.cursor += n
+        return out
+
+    def close(self):
+        self._stopPrefetch()
+        self.fileObject.close()
+
+    def _startPrefetch(self, start, chunkSize):
+        self._stopEvent = threading.Event()
+        self._queue = Queue.Queue(maxsize=self.prefetchDepth)
+        self._chunk = None
+        self._chunkStart = start
+        self._thread = threading.Thread(target=self._prefetch,
+            args=(start, chunkSize, self.chans, self._stopEvent, self._queue))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stopPrefetch(self):
+        if self._thread is not None:
+            self._stopEvent.set()
+            self._thread.join()
+        self._thread = None
+        self._chunk = None
+
+    def _prefetch(self, start, chunkSize, chans, stopEvent, queue):
+        pos = start
+        try:
+            while pos < self.nsamples and not stopEvent.is_set():
+                block = self.readRange(pos, pos+chunkSize, chans)
+                self._put(queue, stopEvent, (pos, block))
+                pos += chunkSize
+        except Exception:
+            self._put(queue, stopEvent, (None, sys.exc_info()))
+
+    def _put(self, queue, stopEvent, item):
+        while not stopEvent.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
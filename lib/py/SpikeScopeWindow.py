@@ -8,20 +8,82 @@ import matplotlib
 from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
 
 from willowephys import WillowDataset
 
-class SpikeScopeWindow(QtGui.QWidget):
+from DatasetRegistry import acquireDataset, releaseDataset
+from SliceCache import cachedCall, IMPORT_ATTRS, FILTER_ATTRS
+from MinMaxPyramid import MinMaxPyramid
+
+SNIPPET_HALFWIDTH = 30  # samples on either side of a threshold crossing
+MAX_SPIKE_LINES = 2000  # beyond this many spikes, a density image is drawn
+
+# filename: WillowDataset that spikes are detected on, for all windows
+_spikeDatasets = {}
+
+def detectSpikes(filename, chan, data, time_ms, thresh=None):
+    """
+    runs willowephys' detectSpikesSlice on one channel's filtered data, on
+    this process's (shared) helper dataset for filename, rather than on the
+    caller's dataset (which may hold many channels). returns the spikes
+    entry of the channel.
+    """
+    if filename not in _spikeDatasets:
+        _spikeDatasets[filename] = WillowDataset(filename)
+    helper = _spikeDatasets[filename]
+    helper.slice_filtered = data[np.newaxis,:]
+    helper.chan2slice_idx = {chan: 0}
+    helper.time_ms = time_ms
+    helper.slice_nsamples = len(data)
+    try:
+        helper.detectSpikesSlice(thresh=thresh)
+        return helper.spikes[0]
+    finally:
+        # don't keep the window's data alive
+        helper.slice_filtered = helper.time_ms = None
+
+def extractSnippets(data, indices, halfwidth=SNIPPET_HALFWIDTH):
+    """
+    returns the waveforms around indices as an (nspikes, 2*halfwidth) array,
+    leaving out spikes within halfwidth samples of the data limits
+    """
+    indices = indices[(indices >= halfwidth) & (indices < len(data) - halfwidth)]
+    return data[indices[:,np.newaxis] + np.arange(-halfwidth, halfwidth)]
 
-    def __init__(self, filename, willowChan):
+class SpikeScopeWindow(QtGui.QWidget):
+    """
+    Filtered data and threshold-crossing waveforms of one channel.
+
+    If the caller already has the channel imported and filtered (e.g. a
+    ShankPlot or WDX window), it can pass its dataset and nothing is read.
+    Otherwise, the dataset shared with the other windows of this process
+    (see DatasetRegistry) is used, and the channel is only imported if that
+    dataset doesn't hold it already. Either way, the window keeps a view of
+    the channel's row, not a copy.
+    """
+
+    def __init__(self, filename, willowChan, dataset=None):
         QtGui.QWidget.__init__(self)
-        self.dataset = WillowDataset(filename)
+        self.filename = filename
         self.chan = willowChan
 
-        self.dataset.importSlice(chans=[self.chan])
-        self.dataset.filterSlice()
-        self.dataset.detectSpikesSlice()
-        self.slice_idx = self.dataset.chan2slice_idx[self.chan]
+        self.acquired = dataset is None
+        if self.acquired:
+            dataset = acquireDataset(filename)
+            if (self.chan not in (getattr(dataset, 'chan2slice_idx', None) or {}) or
+                    getattr(dataset, 'slice_filtered', None) is None):
+                def importAndFilter():
+                    dataset.importSlice(chans=[self.chan])
+                    dataset.filterSlice()
+                cachedCall(dataset, 'filterSlice', importAndFilter,
+                           IMPORT_ATTRS + FILTER_ATTRS, chans=[self.chan])
+        # a view of the channel's row: the dataset may rebind its attributes
+        #   to a new slice later, but that leaves this row as it is
+        slice_idx = dataset.chan2slice_idx[self.chan]
+        self.time_ms = np.asarray(dataset.time_ms)
+        self.data = dataset.slice_filtered[slice_idx,:]
+        self.pyramid = MinMaxPyramid(self.data[np.newaxis,:])
 
         self.spikeLines = None
         self.hline = None
@@ -38,9 +100,15 @@ class SpikeScopeWindow(QtGui.QWidget):
         self.plotData()
 
         self.setWindowTitle('Spike Scope: Channel %d (%s)' % (self.chan,
-                            self.dataset.filename))
+                            self.filename))
         self.setWindowIcon(QtGui.QIcon('../lib/img/leaflabs_logo.png'))
 
+    def closeEvent(self, event):
+        if self.acquired:
+            releaseDataset(self.filename)
+            self.acquired = False
+        QtGui.QWidget.closeEvent(self, event)
+
     def on_click(self, event):
         if (event.inaxes == self.axes_chanPlot):
             if event.button == 2: # middle-click
@@ -71,38 +139,62 @@ class SpikeScopeWindow(QtGui.QWidget):
 
     def plotData(self):
         self.axes_chanPlot.set_axis_bgcolor('k')
-        self.axes_chanPlot.plot(self.dataset.time_ms,
-                    self.dataset.slice_filtered[self.slice_idx,:], color='#8fdb90')
+        self.trace, = self.axes_chanPlot.plot([], [], color='#8fdb90')
+        self.axes_chanPlot.set_xlim(self.time_ms[0], self.time_ms[-1])
+        self.axes_chanPlot.callbacks.connect('xlim_changed', self.updateTrace)
+        self.updateTrace(self.axes_chanPlot)
         self.canvas.draw()
 
+    def updateTrace(self, axes):
+        # draw the min/max envelope of the visible range at the axes' width
+        t0, t1 = axes.get_xlim()
+        start = max(0, np.searchsorted(self.time_ms, t0) - 1)
+        stop = np.searchsorted(self.time_ms, t1) + 1
+        npix = max(100, int(axes.bbox.width))
+        indices, values = self.pyramid.envelope(0, start, stop, npix)
+        self.trace.set_data(self.time_ms[indices], values)
+
     def refreshSpikes(self, thresh=None):
         if self.spikeLines:
             self.spikeLines.remove()
         if self.hline:
             self.hline.remove()
-        self.dataset.detectSpikesSlice(thresh=thresh)
-        spike = self.dataset.spikes[self.slice_idx]
+        spike = detectSpikes(self.filename, self.chan, self.data, self.time_ms,
+                             thresh)
+        self.spikeIndices = np.asarray(spike['indices'], dtype=int)
+        self.thresh = spike['thresh']
+        self.nspikes = spike['nspikes']
         xlim = self.axes_chanPlot.get_xlim()
         ylim = self.axes_chanPlot.get_ylim()
         self.spikeLines = self.axes_chanPlot.vlines(spike['times'],
-                                    ylim[0], ylim[1], colors='#9933ff') 
-        self.hline, = self.axes_chanPlot.plot(xlim, 2*[spike['thresh']], color='y')
+                                    ylim[0], ylim[1], colors='#9933ff')
+        self.hline, = self.axes_chanPlot.plot(xlim, 2*[self.thresh], color='y')
         self.doSpikeScope()
 
     def doSpikeScope(self):
         self.axes_spikeScope.clear()
-        spike = self.dataset.spikes[self.slice_idx]
         self.axes_spikeScope.set_title('Spike Scope: %d Threshold Crossings'
-                                        % spike['nspikes'], fontsize=12)
-        for i in spike['indices']:
-            try:
-                tmpRange = np.arange(i-30, i+30, dtype='int')
-                self.axes_spikeScope.plot((tmpRange-i)/30.,
-                    self.dataset.slice_filtered[self.slice_idx, tmpRange])
-            except IndexError:
-                pass # ignore spikes that are within 30 samples of the data limits
-            self.axes_spikeScope.set_xlabel('ms')
-            self.axes_spikeScope.set_ylabel('uV')
+                                        % self.nspikes, fontsize=12)
+        # spikes within 30 samples of the data limits are ignored
+        snippets = extractSnippets(self.data, self.spikeIndices)
+        t = np.arange(-SNIPPET_HALFWIDTH, SNIPPET_HALFWIDTH)/30.
+        if len(snippets) > MAX_SPIKE_LINES:
+            # too many waveforms to draw legibly: show their density instead
+            ybins = np.linspace(snippets.min(), snippets.max(), 101)
+            density, _, _ = np.histogram2d(snippets.ravel(),
+                np.tile(np.arange(len(t)), len(snippets)),
+                bins=(ybins, np.arange(len(t)+1)))
+            self.axes_spikeScope.imshow(np.log1p(density), origin='lower',
+                aspect='auto', interpolation='nearest', cmap='afmhot',
+                extent=(t[0], t[-1], ybins[0], ybins[-1]))
+        elif len(snippets) > 0:
+            # all waveforms are drawn as a single collection
+            lines = LineCollection(np.dstack(np.broadcast_arrays(t, snippets)),
+                                   colors='#8fdb90', linewidths=0.5, alpha=0.5)
+            self.axes_spikeScope.add_collection(lines)
+            self.axes_spikeScope.autoscale_view()
+        self.axes_spikeScope.set_xlabel('ms')
+        self.axes_spikeScope.set_ylabel('uV')
         self.canvas.draw()
 
 if __name__=='__main__':
@@ -3,10 +3,14 @@
 from PyQt4 import QtGui, QtCore
 import numpy as np
 
+from viridis import viridisBGRA
+
 
 class TimeScrubber(QtGui.QLabel):
 
     timeRangeSelected= QtCore.pyqtSignal(int, int)
+    # while the selection is being dragged, before it is selected
+    timeRangeChanged = QtCore.pyqtSignal(int, int)
 
     def __init__(self, nsamples, initRange=[0,30000], maxSamples=60000):
         QtGui.QLabel.__init__(self)
@@ -45,6 +49,14 @@ class TimeScrubber(QtGui.QLabel):
         self.minsamp = initRange[0]
         self.maxsamp = initRange[1]
 
+        # activity overview (see setOverview), drawn as a heat strip under
+        #   the scrubber, one row per channel
+        self.overview = None
+        self.overviewImage = None
+        self.overviewKey = None
+        self.overviewTimer = QtCore.QTimer()
+        self.overviewTimer.timeout.connect(self.repaint)
+
         self.leftLabel = QtGui.QLabel('0')
         self.rightLabel = QtGui.QLabel(str(self.nsamples))
         for label in [self.leftLabel, self.rightLabel]:
@@ -90,10 +102,47 @@ class TimeScrubber(QtGui.QLabel):
         self.repaint()
         self.timeRangeSelected.emit(self.minsamp, self.maxsamp)
 
+    def setOverview(self, overview):
+        """
+        draw an ActivityOverview under the scrubber (repainting every half
+        second while it is being built)
+        """
+        self.overview = overview
+        self.overviewKey = None
+        if not overview.complete:
+            self.overviewTimer.start(500)
+        self.repaint()
+
+    def setRange(self, minsamp, maxsamp):
+        """
+        move the selection without selecting it (see bang())
+        """
+        self.minsamp = max(0, minsamp)
+        self.maxsamp = min(maxsamp, self.nsamples)
+        self.repaint()
+
+    def step(self):
+        # about a 24th of the selection, in multiples of step_res
+        return max(1, (self.maxsamp - self.minsamp) // (24*self.step_res)) * self.step_res
+
+    def zoom(self, factor):
+        """
+        scale the selection about its center, within step_res and totalsamp
+        """
+        width = (self.maxsamp - self.minsamp) * factor
+        width = int(round(width / self.step_res)) * self.step_res
+        width = min(max(width, self.step_res), self.totalsamp, self.nsamples)
+        center = (self.minsamp + self.maxsamp) // 2
+        minsamp = min(max(0, center - width // 2), self.nsamples - width)
+        self.minsamp = minsamp
+        self.maxsamp = minsamp + width
+        self.bang()
+
     def increment(self):
-        if self.maxsamp < self.nsamples - self.step_res:
-            self.minsamp += self.step_res
-            self.maxsamp += self.step_res
+        step = self.step()
+        if self.maxsamp < self.nsamples - step:
+            self.minsamp += step
+            self.maxsamp += step
             self.bang()
         elif self.maxsamp < self.nsamples:
             difference = self.nsamples - self.maxsamp
@@ -102,9 +151,10 @@ class TimeScrubber(QtGui.QLabel):
             self.bang()
 
     def decrement(self):
-        if self.minsamp > self.step_res:
-            self.minsamp -= self.step_res
-            self.maxsamp -= self.step_res
+        step = self.step()
+        if self.minsamp > step:
+            self.minsamp -= step
+            self.maxsamp -= step
             self.bang()
         elif self.minsamp > 0:
             self.maxsamp -= self.minsamp
@@ -137,6 +187,13 @@ class TimeScrubber(QtGui.QLabel):
         x2 = self.size().width() - self.margin
         y = self.size().height() / 2
 
+        self.scrubberTop = self.size().height() * 1./4
+        self.scrubberBottom = self.size().height() * 3./4
+
+        # draw the activity overview, behind everything else
+        if self.overview is not None:
+            self.drawOverview(painter, x1, x2)
+
         # draw time line and tick labels
         painter.setPen(self.pen_timeline)
         painter.drawLine(x1,y, x2,y)
@@ -150,18 +207,39 @@ class TimeScrubber(QtGui.QLabel):
         painter.setPen(self.pen_scrubber)
         self.scrubberLeft = self._samp2pix(self.minsamp)
         self.scrubberRight = self._samp2pix(self.maxsamp)
-        self.scrubberTop = self.size().height() * 1./4
-        self.scrubberBottom = self.size().height() * 3./4
         w = self.scrubberRight - self.scrubberLeft
         h = self.scrubberBottom - self.scrubberTop
         painter.drawRect(self.scrubberLeft, self.scrubberTop, w, h)
 
+    def drawOverview(self, painter, x1, x2):
+        npix = max(1, x2 - x1)
+        key = (npix, self.overview.ndone, self.overview.complete)
+        if key != self.overviewKey:
+            bgra = viridisBGRA(self.overview.image(npix))
+            self.overviewData = bgra    # the image doesn't own its data
+            self.overviewImage = QtGui.QImage(bgra.data, npix, bgra.shape[0],
+                                              QtGui.QImage.Format_RGB32)
+            self.overviewKey = key
+            if self.overview.complete:
+                self.overviewTimer.stop()
+        target = QtCore.QRectF(x1, self.scrubberTop, npix,
+                               self.scrubberBottom - self.scrubberTop)
+        painter.drawImage(target, self.overviewImage)
+
+    def wheelEvent(self, event):
+        # zoom the selection in and out
+        if event.delta() > 0:
+            self.zoom(1/1.5)
+        elif event.delta() < 0:
+            self.zoom(1.5)
+
     def mousePressEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
             if self.edgeDetect == 0:
                 self.centerHold = True
                 self.setStateCenter(event.pos().x())
                 self.repaint()
+                self.timeRangeChanged.emit(self.minsamp, self.maxsamp)
             elif self.edgeDetect == 1: # left
                 self.leftHold = True
             elif self.edgeDetect == 2: # right
@@ -175,12 +253,15 @@ class TimeScrubber(QtGui.QLabel):
         if self.centerHold:
             self.setStateCenter(x)
             self.repaint()
+            self.timeRangeChanged.emit(self.minsamp, self.maxsamp)
         elif self.leftHold:
             self.setStateLeft(x)
             self.repaint()
+            self.timeRangeChanged.emit(self.minsamp, self.maxsamp)
         elif self.rightHold:
             self.setStateRight(x)
             self.repaint()
+            self.timeRangeChanged.emit(self.minsamp, self.maxsamp)
         else:
             if abs(x - self.scrubberLeft) < self.edgeDetectMargin:
                 if (y > self.scrubberTop) and (y < self.scrubberBottom):
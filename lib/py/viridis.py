@@ -266,3 +266,22 @@ def viridis(val):
     """
     idx = int(np.clip(val,0,1)*255)
     return COLORTABLE[idx]
+
+def viridisArray(vals):
+    """
+    vectorized viridis(): takes an array of values between 0 and 1, returns
+    an array of [R,G,B] with one more (last) dimension
+    """
+    idx = (np.clip(vals,0,1)*255).astype(int)
+    return COLORTABLE[idx]
+
+def viridisBGRA(vals, alpha=255):
+    """
+    viridisArray(), with the colors as [B,G,R,A] bytes, as a QImage of
+    Format_RGB32 or Format_ARGB32 holds them
+    """
+    rgb = viridisArray(vals)
+    bgra = np.empty(rgb.shape[:-1] + (4,), dtype=np.uint8)
+    bgra[...,:3] = rgb[...,::-1]
+    bgra[...,3] = alpha
+    return bgra